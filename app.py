@@ -1,19 +1,62 @@
-from flask import Flask
+import eventlet
+eventlet.monkey_patch()
+
+import signal
+import sys
+
+from flask import Flask, Response
 from flask_socketio import SocketIO
-from models import create_all_tables
+import config
+import metrics
+from db import pool
+from migrations import migrate
+from routes.attachments import attachments_bp
 from routes.auth import auth_bp
-from routes.websocket import socket_io, ws_chat_bp
+from routes.search import search_bp
+from routes.websocket import message_writer, outbound_watchdog, private_room_cache, socket_io, ws_chat_bp
+
+# Runs on import so workers started by any launcher bring the schema up to date;
+# a no-op single query when it already is
+migrate()
 
 app = Flask(__name__)
+app.config['USE_X_SENDFILE'] = config.USE_X_SENDFILE
 app.register_blueprint(auth_bp)
+app.register_blueprint(attachments_bp)
+app.register_blueprint(search_bp)
 app.register_blueprint(ws_chat_bp)
 
-socket_io.init_app(app, cors_allowed_origins="*",async_mode='eventlet')
+# With a message queue every worker relays emits through Redis, so N workers
+# (one per SERVER_PORT) can sit behind a load balancer with sticky sessions
+socket_io.init_app(app, cors_allowed_origins="*",async_mode='eventlet',
+                   message_queue=config.SOCKETIO_MESSAGE_QUEUE,
+                   serializer=config.SOCKETIO_SERIALIZER,
+                   http_compression=config.SOCKETIO_HTTP_COMPRESSION,
+                   compression_threshold=config.SOCKETIO_COMPRESSION_THRESHOLD)
 
 @app.route('/')
 def root():
     return {'type': 'root', 'name': "ajayjasperj"}
 
+@app.route('/stats')
+def stats():
+    return {
+        'db_pool': pool.stats(),
+        'write_behind': message_writer.stats(),
+        'private_room_cache': private_room_cache.stats(),
+        'slow_consumers_disconnected': outbound_watchdog.disconnected,
+    }
+
+metrics.gauge('db_pool_connections', 'Pooled MySQL connections by state',
+              lambda: {(('state', k),): pool.stats()[k] for k in ('in_use', 'idle')})
+metrics.gauge('write_behind_queue_depth', 'Messages waiting to be written to MySQL',
+              lambda: message_writer.stats()['pending'])
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    create_all_tables()
-    socket_io.run(app, debug=True,host='127.0.0.1',port=5002)
+    # Exit through SystemExit so atexit hooks (write-behind flush) run on SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    socket_io.run(app, debug=True,host=config.SERVER_HOST,port=config.SERVER_PORT)
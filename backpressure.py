@@ -0,0 +1,38 @@
+class OutboundWatchdog:
+    """
+    Disconnects sockets whose engine.io outbound queue grew past max_queue
+    packets: a client that stops reading would otherwise make the worker
+    buffer everything sent to it. Disconnected clients catch up through the
+    pending queue and fetch_unread when they reconnect.
+    """
+
+    def __init__(self, get_eio_server, max_queue, interval):
+        self.get_eio_server = get_eio_server  # engine.io server only exists after init_app
+        self.max_queue = max_queue
+        self.interval = interval
+        self.disconnected = 0
+        self._started = False
+
+    def ensure_started(self, start_background_task, sleep):
+        if self._started or self.max_queue <= 0:
+            return
+        self._started = True
+
+        def run():
+            while True:
+                sleep(self.interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"Outbound watchdog error: {e}")
+
+        start_background_task(run)
+
+    def check(self):
+        eio = self.get_eio_server()
+        for eio_sid, sock in list(eio.sockets.items()):
+            queue = getattr(sock, 'queue', None)
+            if queue is not None and queue.qsize() > self.max_queue:
+                print(f"Disconnecting slow consumer {eio_sid}: {queue.qsize()} packets queued")
+                self.disconnected += 1
+                eio.disconnect(eio_sid)
@@ -0,0 +1,296 @@
+"""
+End-to-end load test: N Socket.IO clients register, chat in pairs, chat in
+groups, fetch and mark their unread messages, then disconnect. Reports
+messages/sec, delivery latency percentiles, fetch_unread round trips and
+server memory per connection.
+
+    python benchmarks/bench_chat_load.py --spawn --clients 1000 --messages 20 --record benchmarks/baseline.json
+    python benchmarks/bench_chat_load.py --spawn --clients 1000 --messages 20 --baseline benchmarks/baseline.json
+
+--spawn starts app.py as a single worker with REDIS_URL=fakeredis:// (needs
+fakeredis[lua]) so no Redis server is required; MySQL has to be a real one
+(config.py), since the schema and queries are MySQL-specific. Without
+--spawn the harness drives whatever server is at --url, and memory is only
+reported when --server-pid is given. Users are registered fresh on every run.
+--serializer msgpack runs server and clients with the MessagePack parser;
+chat_packet_bytes and encode_us_per_broadcast compare the wire formats.
+
+No baseline ships with the repo, since the numbers depend on the machine
+and the MySQL server. Create one with --record on the machine you will
+compare on (the first command above), then pass it to later runs with
+--baseline.
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+
+import socketio
+from socketio import packet
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_BOOT = ("import config, app; "
+               "app.socket_io.run(app.app, host=config.SERVER_HOST, port=config.SERVER_PORT)")
+
+
+def post(url, path, body, api_key):
+    req = urllib.request.Request(
+        f"{url}{path}",
+        data=json.dumps(body).encode(),
+        headers={'Content-Type': 'application/json', 'x-api-key': api_key},
+    )
+    with urllib.request.urlopen(req) as resp:
+        return json.loads(resp.read())['content']
+
+
+def create_user(url, username):
+    password = 'bench-password'
+    post(url, '/register', {
+        'username': username, 'email': f"{username}@bench.local",
+        'dob': '2000-01-01', 'gender': 'other', 'password': password,
+    }, 'regkey-12345')
+    content = post(url, '/auth', {'username': username, 'password': password}, 'authkey-12345')
+    return str(content['userid']), content['token']
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def rss_kb(pid):
+    if not pid:
+        return None
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return None
+
+
+def packet_stats(serializer, payload, iterations=10000):
+    """Encoded size of one 'chat' event and the CPU to encode it (once per broadcast)."""
+    if serializer == 'msgpack':
+        from socketio.msgpack_packet import MsgPackPacket as Packet
+    else:
+        Packet = packet.Packet
+    pkt = Packet(packet.EVENT, data=['chat', payload], namespace='/')
+    encoded = pkt.encode()
+    start = time.process_time()
+    for _ in range(iterations):
+        pkt.encode()
+    return len(encoded), (time.process_time() - start) / iterations * 1e6
+
+
+def wait_until(predicate, timeout):
+    deadline = time.perf_counter() + timeout
+    while not predicate() and time.perf_counter() < deadline:
+        eventlet.sleep(0.05)
+    return predicate()
+
+
+class BenchClient:
+    sample = None  # a received 'chat' payload, for packet_stats
+
+    def __init__(self, url, userid, token, delivery_ms, serializer):
+        self.url = url
+        self.userid = userid
+        self.token = token
+        self.delivery_ms = delivery_ms
+        self.received = 0
+        self.room_id = None
+        self.unread = None
+        self.sio = socketio.Client(reconnection=False, serializer=serializer)
+        self.sio.on('chat', self.on_chat)
+        self.sio.on('create_group_response', self.on_create_group)
+        self.sio.on('fetch_unread_response', self.on_unread)
+
+    def connect(self):
+        self.sio.connect(self.url, auth={'token': self.token}, transports=['websocket'])
+
+    def on_chat(self, payload):
+        if str(payload.get('from')) == self.userid:
+            return  # our own echo
+        _, sent_at = payload['msg'].split('|', 1)
+        self.delivery_ms.append((time.perf_counter() - float(sent_at)) * 1000)
+        BenchClient.sample = payload
+        self.received += 1
+
+    def on_create_group(self, payload):
+        self.room_id = payload.get('room_id')
+
+    def on_unread(self, payload):
+        self.unread = payload
+
+    def send_chat(self, to, count):
+        for _ in range(count):
+            self.sio.emit('chat', {'from': self.userid, 'to': to, 'msg': f"bench|{time.perf_counter()}"})
+            eventlet.sleep(0)
+
+    def send_group(self, room_id, count):
+        for _ in range(count):
+            self.sio.emit('group_chat', {'room_id': room_id, 'msg': f"bench|{time.perf_counter()}"})
+            eventlet.sleep(0)
+
+
+def run_phase(pool, jobs):
+    start = time.perf_counter()
+    for job in jobs:
+        pool.spawn_n(*job)
+    pool.waitall()
+    return time.perf_counter() - start
+
+
+def spawn_server(args):
+    env = dict(os.environ, REDIS_URL=args.redis_url, SERVER_PORT=str(args.port), SOCKETIO_MESSAGE_QUEUE='',
+               SOCKETIO_SERIALIZER=args.serializer)
+    server = subprocess.Popen([sys.executable, '-c', SERVER_BOOT], cwd=REPO_ROOT, env=env)
+    url = f"http://127.0.0.1:{args.port}"
+
+    def up():
+        try:
+            urllib.request.urlopen(f"{url}/", timeout=1).close()
+            return True
+        except OSError:
+            return False
+
+    if not wait_until(up, 60):
+        server.kill()
+        raise SystemExit("Server did not start within 60s")
+    return server, url
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5002')
+    parser.add_argument('--spawn', action='store_true', help='start app.py with fakeredis on --port')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--redis-url', default='fakeredis://')
+    parser.add_argument('--server-pid', type=int)
+    parser.add_argument('--serializer', choices=['default', 'msgpack'], default='default',
+                        help='must match SOCKETIO_SERIALIZER when not using --spawn')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=20, help='messages per client in each chat phase')
+    parser.add_argument('--group-size', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for deliveries')
+    parser.add_argument('--record', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against a JSON file written by --record')
+    args = parser.parse_args()
+
+    server = None
+    url, pid = args.url, args.server_pid
+    if args.spawn:
+        server, url = spawn_server(args)
+        pid = server.pid
+    pool = eventlet.GreenPool(args.concurrency)
+    results = {'clients': args.clients, 'messages_per_client': args.messages, 'group_size': args.group_size,
+               'serializer': args.serializer}
+
+    try:
+        run_id = uuid.uuid4().hex[:8]
+        users = [None] * args.clients
+
+        def make_user(i):
+            users[i] = create_user(url, f"bench_{run_id}_{i}")
+
+        run_phase(pool, [(make_user, i) for i in range(args.clients)])
+
+        delivery_ms = []
+        clients = [BenchClient(url, userid, token, delivery_ms, args.serializer) for userid, token in users]
+        rss_before = rss_kb(pid)
+        elapsed = run_phase(pool, [(c.connect,) for c in clients])
+        rss_after = rss_kb(pid)
+        results['connects_per_sec'] = args.clients / elapsed
+        if rss_before is not None:
+            results['rss_kb_per_connection'] = (rss_after - rss_before) / args.clients
+
+        # Private chat: clients paired 0<->1, 2<->3, ...
+        pairs = [(clients[i], clients[i ^ 1]) for i in range(len(clients) - len(clients) % 2)]
+        expected = len(pairs) * args.messages
+        start = time.perf_counter()
+        run_phase(pool, [(a.send_chat, b.userid, args.messages) for a, b in pairs])
+        wait_until(lambda: sum(c.received for c in clients) >= expected, args.timeout)
+        results['chat_msgs_per_sec'] = sum(c.received for c in clients) / (time.perf_counter() - start)
+        results['chat_delivery_p50_ms'] = percentile(delivery_ms, 50)
+        results['chat_delivery_p95_ms'] = percentile(delivery_ms, 95)
+        results['chat_delivery_p99_ms'] = percentile(delivery_ms, 99)
+        if BenchClient.sample:
+            size, encode_us = packet_stats(args.serializer, BenchClient.sample)
+            results['chat_packet_bytes'] = float(size)
+            results['encode_us_per_broadcast'] = encode_us
+
+        # Group chat: every member of each group sends to it
+        groups = [clients[i:i + args.group_size] for i in range(0, len(clients), args.group_size)]
+        groups = [g for g in groups if len(g) > 1]
+        for group in groups:
+            group[0].sio.emit('create_group', {
+                'name': f"bench_{run_id}", 'created_by': group[0].userid,
+                'user_ids': [c.userid for c in group],
+            })
+        wait_until(lambda: all(g[0].room_id for g in groups), args.timeout)
+        delivery_ms.clear()
+        received_before = sum(c.received for c in clients)
+        expected = sum(len(g) * (len(g) - 1) for g in groups) * args.messages
+        start = time.perf_counter()
+        run_phase(pool, [(c.send_group, g[0].room_id, args.messages) for g in groups for c in g])
+        wait_until(lambda: sum(c.received for c in clients) - received_before >= expected, args.timeout)
+        results['group_deliveries_per_sec'] = (sum(c.received for c in clients) - received_before) / (time.perf_counter() - start)
+        results['group_delivery_p50_ms'] = percentile(delivery_ms, 50)
+        results['group_delivery_p95_ms'] = percentile(delivery_ms, 95)
+        results['group_delivery_p99_ms'] = percentile(delivery_ms, 99)
+
+        # fetch_unread round trip, then mark everything fetched as read
+        rtt_ms = []
+
+        def fetch_unread(client):
+            client.unread = None
+            start = time.perf_counter()
+            client.sio.emit('fetch_unread', {'user_id': client.userid, 'limit': 100})
+            if wait_until(lambda: client.unread is not None, args.timeout):
+                rtt_ms.append((time.perf_counter() - start) * 1000)
+
+        run_phase(pool, [(fetch_unread, c) for c in clients])
+        results['fetch_unread_p50_ms'] = percentile(rtt_ms, 50)
+        results['fetch_unread_p99_ms'] = percentile(rtt_ms, 99)
+
+        def mark_read(client):
+            ids = [m['id'] for m in (client.unread or {}).get('messages', [])]
+            if ids:
+                client.sio.emit('mark_read', {'message_ids': ids})
+
+        run_phase(pool, [(mark_read, c) for c in clients])
+
+        elapsed = run_phase(pool, [(c.sio.disconnect,) for c in clients])
+        results['disconnects_per_sec'] = args.clients / elapsed
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    for key, value in results.items():
+        print(f"{key:<28} {value:,.2f}" if isinstance(value, float) else f"{key:<28} {value}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\n{'vs baseline':<28} {'baseline':>12} {'now':>12} {'change':>8}")
+        for key, value in results.items():
+            before = baseline.get(key)
+            if isinstance(value, float) and before:
+                print(f"{key:<28} {before:>12,.2f} {value:>12,.2f} {(value - before) / before:>+8.1%}")
+    if args.record:
+        with open(args.record, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
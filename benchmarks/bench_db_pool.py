@@ -0,0 +1,117 @@
+"""
+Messages/sec for the chat save path with a fresh connection per message
+(the old get_db_connection behaviour) versus the shared pool.
+
+    python benchmarks/bench_db_pool.py --messages 2000 --concurrency 50 --sender 1 --receiver 2
+
+Needs the MySQL configured in config.py with the chatapp schema and two
+existing users. Rows are written to the real messages table.
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymysql
+
+import config
+from db import ConnectionPool
+
+SAVE_SQL = (
+    "INSERT INTO messages (room_id, sender_id, message) VALUES (%s, %s, %s)",
+    "UPDATE chat_rooms SET last_message_at = NOW(6) WHERE id = %s",
+)
+
+
+def connect():
+    return pymysql.connect(
+        host=config.DB_HOST,
+        port=config.DB_PORT,
+        user=config.DB_USER,
+        password=config.DB_PASSWORD,
+        database=config.DB_NAME,
+        cursorclass=pymysql.cursors.DictCursor,
+    )
+
+
+def lookup_room(conn, sender, receiver):
+    user1, user2 = sorted([sender, receiver])
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT rp1.room_id FROM room_participants rp1
+            JOIN room_participants rp2 ON rp1.room_id = rp2.room_id
+            WHERE rp1.user_id = %s AND rp2.user_id = %s AND rp1.room_id != 0
+            LIMIT 1
+        """, (user1, user2))
+        row = cursor.fetchone()
+    if not row:
+        raise SystemExit(f"No private room for users {user1} and {user2}; send one chat message first")
+    return row['room_id']
+
+
+def save(conn, room_id, sender, i):
+    with conn.cursor() as cursor:
+        cursor.execute(SAVE_SQL[0], (room_id, sender, f"bench message {i}"))
+        cursor.execute(SAVE_SQL[1], (room_id,))
+    conn.commit()
+
+
+def run(label, worker, messages, concurrency):
+    green_pool = eventlet.GreenPool(concurrency)
+    start = time.perf_counter()
+    for i in range(messages):
+        green_pool.spawn_n(worker, i)
+    green_pool.waitall()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {messages} messages in {elapsed:.2f}s -> {messages / elapsed:,.0f} msg/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--sender', type=int, required=True)
+    parser.add_argument('--receiver', type=int, required=True)
+    parser.add_argument('--pool-size', type=int, default=config.DB_POOL_MAX_SIZE)
+    args = parser.parse_args()
+
+    conn = connect()
+    room_id = lookup_room(conn, args.sender, args.receiver)
+    conn.close()
+
+    def unpooled(i):
+        conn = connect()
+        try:
+            save(conn, room_id, args.sender, i)
+        finally:
+            conn.close()
+
+    pool = ConnectionPool(
+        max_size=args.pool_size,
+        timeout=config.DB_POOL_TIMEOUT,
+        health_check_after=config.DB_POOL_HEALTH_CHECK_AFTER,
+        host=config.DB_HOST,
+        port=config.DB_PORT,
+        user=config.DB_USER,
+        password=config.DB_PASSWORD,
+        database=config.DB_NAME,
+        cursorclass=pymysql.cursors.DictCursor,
+    )
+
+    def pooled(i):
+        with pool.connection() as conn:
+            save(conn, room_id, args.sender, i)
+
+    run("unpooled", unpooled, args.messages, args.concurrency)
+    run("pooled", pooled, args.messages, args.concurrency)
+    print(f"pool stats: {pool.stats()}")
+    pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Logins/sec during a login storm, and the socket round-trip latency other
+clients see on the same worker while it runs.
+
+    python benchmarks/bench_login_storm.py --username alice --password secret --logins 500 --concurrency 50
+
+Needs a running server (python app.py) and an existing user. The probe socket
+logs in once, connects with its token and repeatedly calls an acknowledged
+event; p50/p99 of those calls are reported for an idle period and during the
+storm. Compare runs with PASSWORD_HASH_THREADS / PASSWORD_SCRYPT_LOG_N to see
+the effect of the offload pool and hash cost.
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import json
+import time
+import urllib.request
+
+import socketio
+
+
+def login(url, username, password):
+    req = urllib.request.Request(
+        f"{url}/auth",
+        data=json.dumps({'username': username, 'password': password}).encode(),
+        headers={'Content-Type': 'application/json', 'x-api-key': 'authkey-12345'},
+    )
+    with urllib.request.urlopen(req) as resp:
+        return json.loads(resp.read())['content']['token']
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def probe(sio, seconds):
+    samples = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        sio.call('fetch_unread_counts', {}, timeout=30)
+        samples.append((time.perf_counter() - start) * 1000)
+        eventlet.sleep(0.01)
+    return samples
+
+
+def report(label, samples):
+    print(f"{label:<14} socket rtt p50={percentile(samples, 50):.1f}ms p99={percentile(samples, 99):.1f}ms "
+          f"({len(samples)} calls)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5002')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--logins', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--idle-seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    sio = socketio.Client()
+    sio.connect(args.url, auth={'token': login(args.url, args.username, args.password)})
+    report("idle", probe(sio, args.idle_seconds))
+
+    storm_samples = []
+    storm_done = []
+
+    def storm():
+        pool = eventlet.GreenPool(args.concurrency)
+        start = time.perf_counter()
+        for _ in range(args.logins):
+            pool.spawn_n(login, args.url, args.username, args.password)
+        pool.waitall()
+        storm_done.append(time.perf_counter() - start)
+
+    storm_thread = eventlet.spawn(storm)
+    while not storm_done:
+        storm_samples.extend(probe(sio, 0.5))
+    storm_thread.wait()
+
+    elapsed = storm_done[0]
+    print(f"logins         {args.logins} in {elapsed:.2f}s -> {args.logins / elapsed:,.1f} logins/s")
+    report("during storm", storm_samples)
+    sio.disconnect()
+
+
+if __name__ == '__main__':
+    main()
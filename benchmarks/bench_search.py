@@ -0,0 +1,111 @@
+"""
+Latency of search_messages (FULLTEXT MATCH ... AGAINST) for common, mid-
+frequency and rare terms, optionally after seeding a large messages table.
+
+    python benchmarks/bench_search.py --user-id 1 --seed 2000000 --rooms 1000 --member-rooms 3
+    python benchmarks/bench_search.py --user-id 1 --queries 200
+
+Needs the MySQL configured in config.py at schema version 5 (ft_message
+index). Seeding creates --rooms group rooms and spreads the messages evenly
+over them, with --user-id a participant of only --member-rooms of them. That
+is the expensive case: MATCH finds matches across the whole table and the
+room_participants join then throws most of them away. Words follow a
+Zipf-like distribution over a fixed vocabulary so term frequency varies the
+way it does in chat.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import get_db_connection
+from routes.search import search_messages
+
+VOCABULARY_SIZE = 20000
+
+
+def vocabulary(seed=42):
+    rng = random.Random(seed)
+    return [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(VOCABULARY_SIZE)]
+
+
+def seed_rooms(user_id, rooms, member_rooms):
+    """Create `rooms` group rooms; user_id joins the first `member_rooms`. Returns their ids."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            room_ids = []
+            for n in range(rooms):
+                cursor.execute("INSERT INTO chat_rooms (name, created_by, is_group) VALUES (%s, %s, TRUE)",
+                               (f"bench-search-{n}", user_id))
+                room_ids.append(cursor.lastrowid)
+            cursor.executemany("INSERT IGNORE INTO room_participants (room_id, user_id) VALUES (%s, %s)",
+                               [(room_id, user_id) for room_id in room_ids[:member_rooms]])
+            conn.commit()
+    return room_ids
+
+
+def seed_messages(words, room_ids, sender_id, count, batch=5000):
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    rng = random.Random(7)
+    start = time.perf_counter()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            for done in range(0, count, batch):
+                rows = [(rng.choice(room_ids), sender_id, ' '.join(rng.choices(words, weights, k=rng.randint(3, 20))))
+                        for _ in range(min(batch, count - done))]
+                cursor.executemany("INSERT INTO messages (room_id, sender_id, message) VALUES (%s, %s, %s)", rows)
+                conn.commit()
+                print(f"\rseeded {done + len(rows):,}/{count:,}", end='', flush=True)
+    print(f"\nseeded {count:,} messages in {time.perf_counter() - start:.1f}s")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument('--seed', type=int, default=0, help='messages to insert before measuring')
+    parser.add_argument('--rooms', type=int, default=1000, help='rooms to spread seeded messages over')
+    parser.add_argument('--member-rooms', type=int, default=3, help='seeded rooms --user-id participates in')
+    parser.add_argument('--queries', type=int, default=100, help='queries per term class')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    words = vocabulary()
+    if args.seed:
+        if not 0 < args.member_rooms <= args.rooms:
+            parser.error('--member-rooms must be between 1 and --rooms')
+        room_ids = seed_rooms(args.user_id, args.rooms, args.member_rooms)
+        seed_messages(words, room_ids, args.user_id, args.seed)
+        print(f"user {args.user_id} is in {args.member_rooms} of {args.rooms} seeded rooms "
+              f"(~{args.seed * args.member_rooms // args.rooms:,} seeded messages are in their rooms)")
+
+    rng = random.Random(1)
+    classes = {
+        'common': lambda: rng.choice(words[:20]),
+        'mid': lambda: rng.choice(words[200:2000]),
+        'rare': lambda: rng.choice(words[10000:]),
+        'two words': lambda: f"{rng.choice(words[:200])} {rng.choice(words[200:2000])}",
+        'prefix': lambda: rng.choice(words[:2000])[:3],
+    }
+    for name, make_query in classes.items():
+        samples = []
+        hits = 0
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            messages, _ = search_messages(args.user_id, make_query(), args.limit)
+            samples.append((time.perf_counter() - start) * 1000)
+            hits += len(messages)
+        print(f"{name:<10} p50={percentile(samples, 50):7.1f}ms p99={percentile(samples, 99):7.1f}ms "
+              f"avg hits/page={hits / args.queries:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import hashlib
+import math
+import time
+
+
+def bloom_parameters(capacity, error_rate):
+    """(num_bits, num_hashes) for capacity items at error_rate."""
+    num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+    return num_bits, max(1, round(num_bits / capacity * math.log(2)))
+
+
+def bloom_positions(item, num_bits, num_hashes):
+    digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    # Kirsch-Mitzenmacher double hashing
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+
+# KEYS: live bitmap, building bitmap, building flag. ARGV: bit positions.
+# While a build runs, additions go to both bitmaps so the new one has them too.
+_ADD_SCRIPT = """
+local building = redis.call('EXISTS', KEYS[3]) == 1
+for i = 1, #ARGV do
+    redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+    if building then
+        redis.call('SETBIT', KEYS[2], ARGV[i], 1)
+    end
+end
+return 0
+"""
+
+# KEYS: live bitmap, building bitmap, building flag, ready key. ARGV: ready value.
+_PUBLISH_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('RENAME', KEYS[2], KEYS[1])
+else
+    redis.call('DEL', KEYS[1])
+end
+redis.call('SET', KEYS[4], ARGV[1])
+redis.call('DEL', KEYS[3])
+return 0
+"""
+
+
+class RedisBloomFilter:
+    """
+    Bloom filter kept as a Redis bitmap, so every worker sees every addition
+    as soon as it is made. A False from might_contain means the item was
+    never added; True may be a false positive at roughly error_rate once
+    capacity items are in. Lookups are only answered once a full build from
+    the source of truth has been published (the ready key records the
+    parameters and build time); until then might_contain returns None.
+    """
+
+    def __init__(self, client, key, capacity, error_rate, build_timeout=3600):
+        self.client = client
+        self.num_bits, self.num_hashes = bloom_parameters(capacity, error_rate)
+        self.build_timeout = build_timeout
+        self._keys = [key, f"{key}:building", f"{key}:building_flag", f"{key}:ready"]
+        self._add = client.register_script(_ADD_SCRIPT)
+        self._publish = client.register_script(_PUBLISH_SCRIPT)
+
+    def _positions(self, item):
+        return bloom_positions(item, self.num_bits, self.num_hashes)
+
+    def built_at(self):
+        """Unix time of the published build, or None if there is none for these parameters."""
+        return self._built_at(self.client.get(self._keys[3]))
+
+    def _built_at(self, ready):
+        if not ready:
+            return None
+        num_bits, num_hashes, built_at = ready.split(':')
+        if (int(num_bits), int(num_hashes)) != (self.num_bits, self.num_hashes):
+            return None  # built with other settings; its bit positions don't apply
+        return float(built_at)
+
+    def invalidate(self):
+        """Stop answering lookups until the next build is published."""
+        self.client.delete(self._keys[3])
+
+    def add(self, *items):
+        pipe = self.client.pipeline(transaction=False)
+        for item in items:
+            self._add(keys=self._keys[:3], args=self._positions(item), client=pipe)
+        pipe.execute()
+
+    def might_contain(self, item):
+        """False: never added. True: maybe added. None: no usable build yet."""
+        live, _, _, ready_key = self._keys
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(ready_key)
+        for pos in self._positions(item):
+            pipe.getbit(live, pos)
+        ready, *bits = pipe.execute()
+        if self._built_at(ready) is None:
+            return None
+        return all(bits)
+
+    def build(self, items, batch=10000):
+        """
+        Rebuild from items (every value that must be in the filter). Returns
+        False without doing anything if another worker is already building.
+        The building flag is set before items is read, so anything added
+        after the read starts also lands in the new bitmap.
+        """
+        building, flag = self._keys[1], self._keys[2]
+        if not self.client.set(flag, 1, nx=True, ex=self.build_timeout):
+            return False
+        try:
+            self.client.delete(building)
+            pipe = self.client.pipeline(transaction=False)
+            pending = 0
+            for item in items:
+                for pos in self._positions(item):
+                    pipe.setbit(building, pos, 1)
+                pending += 1
+                if pending >= batch:
+                    pipe.execute()
+                    pending = 0
+            pipe.execute()
+        except Exception:
+            self.client.delete(flag)  # let the next attempt start right away
+            raise
+        self._publish(keys=self._keys, args=[f"{self.num_bits}:{self.num_hashes}:{time.time()}"])
+        return True
@@ -0,0 +1,144 @@
+import os
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def _env_limits(name, default):
+    """'event=rate/burst,...' -> {event: (rate, burst)}"""
+    limits = {}
+    for item in filter(None, os.environ.get(name, default).split(',')):
+        event, spec = item.split('=')
+        rate, burst = spec.split('/')
+        limits[event.strip()] = (float(rate), int(burst))
+    return limits
+
+
+# MySQL
+DB_HOST = os.environ.get("DB_HOST", "localhost")
+DB_PORT = _env_int("DB_PORT", 5001)
+DB_USER = os.environ.get("DB_USER", "root")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "822048")
+DB_NAME = os.environ.get("DB_NAME", "chatapp")
+
+# Connection pool
+DB_POOL_MAX_SIZE = _env_int("DB_POOL_MAX_SIZE", 20)
+DB_POOL_TIMEOUT = _env_float("DB_POOL_TIMEOUT", 5.0)             # seconds to wait for a free connection
+DB_POOL_HEALTH_CHECK_AFTER = _env_float("DB_POOL_HEALTH_CHECK_AFTER", 30.0)  # ping connections idle longer than this
+
+# Write-behind message persistence for the 'chat' event
+WRITE_BEHIND_ENABLED = os.environ.get("WRITE_BEHIND_ENABLED", "0") == "1"
+WRITE_BEHIND_BATCH_SIZE = _env_int("WRITE_BEHIND_BATCH_SIZE", 200)
+WRITE_BEHIND_FLUSH_INTERVAL = _env_float("WRITE_BEHIND_FLUSH_INTERVAL", 0.05)  # seconds
+WRITE_BEHIND_MAX_QUEUE = _env_int("WRITE_BEHIND_MAX_QUEUE", 10000)
+WRITE_BEHIND_PUT_TIMEOUT = _env_float("WRITE_BEHIND_PUT_TIMEOUT", 1.0)  # seconds a sender may block on a full queue
+
+# In-process caches
+PRIVATE_ROOM_CACHE_SIZE = _env_int("PRIVATE_ROOM_CACHE_SIZE", 100000)
+
+# Redis / multi-worker
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")  # fakeredis:// for single-worker benchmarks
+# Set to a redis:// URL (usually REDIS_URL) to run several workers behind a load balancer
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE") or None
+# 'msgpack' switches the Socket.IO packet format to MessagePack; every client must
+# then connect with the msgpack parser, so roll it out with the apps
+SOCKETIO_SERIALIZER = os.environ.get("SOCKETIO_SERIALIZER", "default")
+# gzip/deflate for long-polling responses above the threshold (bytes); websocket
+# frames use permessage-deflate when the client offers it
+SOCKETIO_HTTP_COMPRESSION = os.environ.get("SOCKETIO_HTTP_COMPRESSION", "1") == "1"
+SOCKETIO_COMPRESSION_THRESHOLD = _env_int("SOCKETIO_COMPRESSION_THRESHOLD", 1024)
+PRESENCE_TTL = _env_int("PRESENCE_TTL", 60)  # seconds a worker's presence entries survive without a heartbeat
+
+# Server
+SERVER_HOST = os.environ.get("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = _env_int("SERVER_PORT", 5002)
+
+# Presence events
+PRESENCE_COALESCE_INTERVAL = _env_float("PRESENCE_COALESCE_INTERVAL", 0)  # seconds; 0 emits each change immediately
+ONLINE_USERS_PAGE_MAX = _env_int("ONLINE_USERS_PAGE_MAX", 500)
+MEMBERSHIP_CACHE_TTL = _env_int("MEMBERSHIP_CACHE_TTL", 3600)  # seconds an unused room/user membership set stays in Redis
+
+# Delivery/read receipts
+RECEIPT_COALESCE_INTERVAL = _env_float("RECEIPT_COALESCE_INTERVAL", 0.25)  # seconds; 0 writes each request immediately
+RECEIPT_MAX_IDS = _env_int("RECEIPT_MAX_IDS", 1000)  # message ids accepted per receipt event
+
+# Offline delivery queue: chat sent to an offline user is pushed to them on their next connect
+PENDING_MAX_LEN = _env_int("PENDING_MAX_LEN", 1000)      # newest messages kept per user; older ones only via fetch_unread
+PENDING_TTL = _env_int("PENDING_TTL", 7 * 86400)
+PENDING_CHUNK_SIZE = _env_int("PENDING_CHUNK_SIZE", 100)
+PENDING_ACK_TIMEOUT = _env_float("PENDING_ACK_TIMEOUT", 10)  # seconds to wait for a chunk's ack before leaving it queued
+
+# History / unread pagination
+HISTORY_PAGE_DEFAULT = _env_int("HISTORY_PAGE_DEFAULT", 50)
+HISTORY_PAGE_MAX = _env_int("HISTORY_PAGE_MAX", 200)
+STREAM_CHUNK_SIZE = _env_int("STREAM_CHUNK_SIZE", 200)  # rows per emitted chunk in streaming mode
+SEARCH_PAGE_DEFAULT = _env_int("SEARCH_PAGE_DEFAULT", 20)
+SEARCH_PAGE_MAX = _env_int("SEARCH_PAGE_MAX", 100)
+SEARCH_MAX_OFFSET = _env_int("SEARCH_MAX_OFFSET", 1000)  # ranked results are paged by offset; deeper pages are refused
+# Newest messages per room kept in Redis for the latest history page; 0 disables
+ROOM_HISTORY_CACHE_SIZE = _env_int("ROOM_HISTORY_CACHE_SIZE", 100)
+ROOM_HISTORY_CACHE_TTL = _env_int("ROOM_HISTORY_CACHE_TTL", 3600)  # seconds an idle room's cache survives
+
+# Unread tracking: 'status' keeps one message_status row per (message, recipient);
+# 'watermark' keeps last read/delivered message ids on room_participants
+UNREAD_MODEL = os.environ.get("UNREAD_MODEL", "status")
+UNREAD_CACHE_TTL = _env_int("UNREAD_CACHE_TTL", 86400)
+
+# Conversation list (fetch_rooms)
+ROOM_INDEX_TTL = _env_int("ROOM_INDEX_TTL", 86400)  # seconds an unused room list / room summary stays in Redis
+ROOMS_PAGE_DEFAULT = _env_int("ROOMS_PAGE_DEFAULT", 30)
+ROOMS_PAGE_MAX = _env_int("ROOMS_PAGE_MAX", 100)
+
+# Socket event rate limits per user and event: rate events/s, bursts up to burst
+SOCKET_RATE_LIMITS = _env_limits(
+    "SOCKET_RATE_LIMITS",
+    "chat=10/30,group_chat=10/30,attachment=2/10,create_group=0.2/5,"
+    "fetch_history=5/20,fetch_unread=5/20,get_online_users=2/10,search_messages=2/10,fetch_rooms=5/20,"
+    "register=1/5,join_group=1/10,mark_delivered=20/60,mark_read=20/60,fetch_pending=1/5,fetch_unread_counts=2/10",
+)
+SOCKET_RATE_LIMIT_SHARED = os.environ.get("SOCKET_RATE_LIMIT_SHARED", "0") == "1"  # also enforce across workers via Redis
+# chat to 'all' reaches every socket; this bounds it for all senders together, across workers
+BROADCAST_RATE = _env_float("BROADCAST_RATE", 0.5)
+BROADCAST_BURST = _env_int("BROADCAST_BURST", 3)
+# Sockets with more packets than this waiting to be sent are disconnected; 0 disables
+SOCKET_MAX_OUTBOUND_QUEUE = _env_int("SOCKET_MAX_OUTBOUND_QUEUE", 1000)
+OUTBOUND_CHECK_INTERVAL = _env_float("OUTBOUND_CHECK_INTERVAL", 2)
+
+# Auth
+JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-very-secret-key")
+TOKEN_CACHE_SIZE = _env_int("TOKEN_CACHE_SIZE", 50000)
+# When set, sockets must present a valid JWT on connect; the legacy 'register' with a bare userid is refused
+SOCKET_AUTH_REQUIRED = os.environ.get("SOCKET_AUTH_REQUIRED", "0") == "1"
+
+# Password hashing (scrypt); cost is n=2**PASSWORD_SCRYPT_LOG_N, raising it rehashes users on their next login
+PASSWORD_SCRYPT_LOG_N = _env_int("PASSWORD_SCRYPT_LOG_N", 14)
+PASSWORD_SCRYPT_R = _env_int("PASSWORD_SCRYPT_R", 8)
+PASSWORD_SCRYPT_P = _env_int("PASSWORD_SCRYPT_P", 1)
+PASSWORD_HASH_THREADS = _env_int("PASSWORD_HASH_THREADS", 0)  # OS threads for hashing; 0 keeps eventlet's default (20)
+
+# /check_exist availability checks
+TAKEN_NAMES_BLOOM_CAPACITY = _env_int("TAKEN_NAMES_BLOOM_CAPACITY", 2000000)  # usernames + emails
+TAKEN_NAMES_BLOOM_ERROR_RATE = _env_float("TAKEN_NAMES_BLOOM_ERROR_RATE", 0.001)
+TAKEN_NAMES_REBUILD_INTERVAL = _env_float("TAKEN_NAMES_REBUILD_INTERVAL", 86400)  # drops deleted names; additions are live
+CHECK_EXIST_CACHE_TTL = _env_float("CHECK_EXIST_CACHE_TTL", 30)
+CHECK_EXIST_RATE = _env_float("CHECK_EXIST_RATE", 5)     # requests per second per client
+CHECK_EXIST_BURST = _env_int("CHECK_EXIST_BURST", 20)
+
+# Attachments
+ATTACHMENT_ROOT = os.environ.get("ATTACHMENT_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage"))
+ATTACHMENT_MAX_SIZE = _env_int("ATTACHMENT_MAX_SIZE", 100 * 1024 * 1024)
+ATTACHMENT_CHUNK_SIZE = _env_int("ATTACHMENT_CHUNK_SIZE", 64 * 1024)
+ATTACHMENT_UPLOAD_TTL = _env_int("ATTACHMENT_UPLOAD_TTL", 24 * 3600)  # seconds an unfinished upload can be resumed
+ATTACHMENT_MAX_OPEN_UPLOADS = _env_int("ATTACHMENT_MAX_OPEN_UPLOADS", 5)  # unfinished uploads per user
+ATTACHMENT_UPLOAD_LOCK_TTL = _env_int("ATTACHMENT_UPLOAD_LOCK_TTL", 600)  # longest a single chunk PUT may take
+ATTACHMENT_SWEEP_INTERVAL = _env_float("ATTACHMENT_SWEEP_INTERVAL", 300)  # seconds between sweeps of abandoned upload files
+# Let a fronting nginx/Apache serve downloads with sendfile via X-Sendfile
+USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE", "0") == "1"
+
+# Instrumentation exposed at /metrics (Prometheus text format); off means handlers are not wrapped at all
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
@@ -1,11 +1,210 @@
+import threading
+import time
+from contextlib import contextmanager
+
 import pymysql
+from pymysql.constants import SERVER_STATUS
+
+import config
+import metrics
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class PooledConnection:
+    """
+    Thin proxy around a pymysql connection checked out of a ConnectionPool.
+    close() (or leaving a `with` block) hands the connection back to the pool
+    instead of tearing down the socket.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+        self._checked_out_at = time.perf_counter() if metrics.ENABLED else None
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            try:
+                self._raw.rollback()
+            except pymysql.MySQLError:
+                self._pool.release(self._raw, discard=True)
+                self._released = True
+                return False
+        self.close()
+        return False
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw)
+            if self._checked_out_at is not None:
+                metrics.record_db(time.perf_counter() - self._checked_out_at)
+
+
+class ConnectionPool:
+    def __init__(self, max_size, timeout, health_check_after, **connect_kwargs):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self._connect_kwargs = connect_kwargs
+        self._idle = []  # LIFO, so the warmest connection is reused first
+        self._lock = threading.Lock()
+        # Signalled whenever a connection is returned or a slot is freed, so a
+        # waiter wakes for either. Green once app.py has monkey-patched threading.
+        self._available = threading.Condition(self._lock)
+        self._size = 0
+        self._stats = {
+            "created": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "discarded": 0,
+        }
+
+    def _connect(self):
+        raw = pymysql.connect(**self._connect_kwargs)
+        raw._pool_last_used = time.monotonic()
+        self._stats["created"] += 1
+        if metrics.ENABLED:
+            metrics.record_connection_opened()
+        return raw
+
+    def _free_slot(self):
+        with self._available:
+            self._size -= 1
+            self._available.notify()
+
+    def _is_healthy(self, raw):
+        if time.monotonic() - raw._pool_last_used < self.health_check_after:
+            return True
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except pymysql.MySQLError:
+            self._stats["health_check_failures"] += 1
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._available:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available within {self.timeout}s "
+                            f"(pool size {self.max_size})"
+                        )
+                    self._stats["waits"] += 1
+                    self._available.wait(remaining)
+                if self._idle:
+                    raw = self._idle.pop()
+                else:
+                    raw = None
+                    self._size += 1  # reserve the slot; connect outside the lock
+            if raw is None:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    self._free_slot()
+                    raise
+            elif not self._is_healthy(raw):
+                self._discard(raw)
+                continue
+            self._stats["checkouts"] += 1
+            return PooledConnection(self, raw)
+
+    def release(self, raw, discard=False):
+        if discard or not raw.open:
+            self._discard(raw)
+            return
+        try:
+            # Never hand out a connection with a transaction (and its snapshot) still open
+            if raw.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                raw.rollback()
+        except pymysql.MySQLError:
+            self._discard(raw)
+            return
+        raw._pool_last_used = time.monotonic()
+        with self._available:
+            self._idle.append(raw)
+            self._available.notify()
+
+    def _discard(self, raw):
+        self._stats["discarded"] += 1
+        self._free_slot()
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        with conn:
+            yield conn
+
+    def stats(self):
+        with self._lock:
+            size, idle = self._size, len(self._idle)
+        return dict(
+            self._stats,
+            size=size,
+            idle=idle,
+            in_use=size - idle,
+            max_size=self.max_size,
+        )
+
+    def close_all(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                raw = self._idle.pop()
+            self._discard(raw)
+
+
+pool = ConnectionPool(
+    max_size=config.DB_POOL_MAX_SIZE,
+    timeout=config.DB_POOL_TIMEOUT,
+    health_check_after=config.DB_POOL_HEALTH_CHECK_AFTER,
+    host=config.DB_HOST,
+    port=config.DB_PORT,
+    user=config.DB_USER,
+    password=config.DB_PASSWORD,
+    database=config.DB_NAME,
+    cursorclass=pymysql.cursors.DictCursor,
+)
+
 
 def get_db_connection():
-    return pymysql.connect(
-        host="localhost",
-        port=5001,
-        user="root",
-        password="822048",
-        database="chatapp",
-        cursorclass=pymysql.cursors.DictCursor
-    )
+    """
+    Check a connection out of the shared pool. Use it as a context manager
+    (`with get_db_connection() as conn:`) so it is always returned, even on error.
+    """
+    return pool.acquire()
+
+
+def make_redis_client(url):
+    if url.startswith('fakeredis://'):
+        # In-process stand-in for benchmarks on a single worker; the Lua
+        # scripts need fakeredis[lua]
+        import fakeredis
+        return fakeredis.FakeRedis(decode_responses=True)
+    # Subclass of redis.Redis that times each command when metrics are enabled
+    return metrics.InstrumentedRedis.from_url(url, decode_responses=True)
+
+
+redis_client = make_redis_client(config.REDIS_URL)
@@ -0,0 +1,76 @@
+import json
+
+HISTORY_KEY_PREFIX = "room_history:"        # room_history:<room_id> -> zset of JSON messages scored by message id
+STATE_KEY_PREFIX = "room_history_state:"    # 'complete': the zset holds the whole room; 'partial': older rows exist
+
+# ARGV: size, ttl, state ('' leaves it alone), then score/member pairs.
+# Trimming below a 'complete' room means older rows now exist only in MySQL.
+_ADD_SCRIPT = """
+local size = tonumber(ARGV[1])
+for i = 4, #ARGV, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+if ARGV[3] ~= '' then
+    redis.call('SET', KEYS[2], ARGV[3])
+end
+if redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -(size + 1)) > 0 and redis.call('GET', KEYS[2]) == 'complete' then
+    redis.call('SET', KEYS[2], 'partial')
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+return 0
+"""
+
+
+class RecentHistory:
+    """
+    Write-through cache of the newest `size` messages per room in Redis, so
+    opening an active room doesn't touch the messages table. Messages are
+    added after they commit; the room only answers reads once it has been
+    filled from MySQL (which merges with anything written meanwhile). Rooms
+    nobody writes to or reads from expire after ttl seconds.
+    """
+
+    def __init__(self, client, size, ttl):
+        self.client = client
+        self.size = size
+        self.ttl = ttl
+        self._add_script = client.register_script(_ADD_SCRIPT)
+
+    def _keys(self, room_id):
+        return [f"{HISTORY_KEY_PREFIX}{room_id}", f"{STATE_KEY_PREFIX}{room_id}"]
+
+    def _add(self, room_id, messages, state=''):
+        args = [self.size, self.ttl, state]
+        for message in messages:
+            args.extend([message['id'], json.dumps(message, default=str)])
+        self._add_script(keys=self._keys(room_id), args=args)
+
+    def append(self, messages):
+        """messages: serialized rows (id, room_id, ...) that were just committed."""
+        by_room = {}
+        for message in messages:
+            by_room.setdefault(message['room_id'], []).append(message)
+        for room_id, room_messages in by_room.items():
+            self._add(room_id, room_messages)
+
+    def fill(self, room_id, messages, complete):
+        """Load the newest rows from MySQL; complete means the room has no older ones."""
+        self._add(room_id, messages, 'complete' if complete else 'partial')
+
+    def latest(self, room_id, limit):
+        """(messages ascending by id, has_more), or None when the cache can't answer."""
+        history_key, state_key = self._keys(room_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(state_key)
+        pipe.zrevrange(history_key, 0, limit)
+        state, items = pipe.execute()
+        if state is None:
+            return None
+        if len(items) > limit:
+            return [json.loads(item) for item in reversed(items[:limit])], True
+        if state != 'complete':
+            return None  # the rest of the page is only in MySQL
+        return [json.loads(item) for item in reversed(items)], False
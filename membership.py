@@ -0,0 +1,75 @@
+ROOM_MEMBERS_PREFIX = "room_members:"  # room_members:<room_id> -> set of user ids
+USER_ROOMS_PREFIX = "user_rooms:"      # user_rooms:<user_id> -> set of room ids
+
+# Only extend sets that are already cached; a missing set is loaded from
+# MySQL in full on the next read, so adding to it here would make it look
+# complete when it is not.
+_ADD_IF_CACHED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SADD', KEYS[1], unpack(ARGV))
+end
+return 0
+"""
+
+
+class RoomMembership:
+    """
+    Read-through cache of room_participants in Redis, shared by all workers.
+    Sets are loaded from MySQL on first use and kept current by
+    create_group_chat_room/add_user_to_group and private room creation.
+    """
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+        self._add_if_cached = client.register_script(_ADD_IF_CACHED_SCRIPT)
+
+    def _load(self, key, values):
+        if not values:
+            return
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        pipe.sadd(key, *values)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def _cached_set(self, key, loader):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.smembers(key)
+        pipe.expire(key, self.ttl)
+        members, _ = pipe.execute()
+        if members:
+            return set(members)
+        values = {str(v) for v in loader()}
+        self._load(key, values)
+        return values
+
+    def members(self, room_id, loader):
+        """User ids (as str) in room_id; loader() fetches them from MySQL on a miss."""
+        return self._cached_set(f"{ROOM_MEMBERS_PREFIX}{room_id}", loader)
+
+    def rooms_of(self, user_id, loader):
+        """Room ids (as str) user_id participates in; loader() fetches them on a miss."""
+        return self._cached_set(f"{USER_ROOMS_PREFIX}{user_id}", loader)
+
+    def is_member(self, room_id, user_id, loader):
+        key = f"{ROOM_MEMBERS_PREFIX}{room_id}"
+        pipe = self.client.pipeline(transaction=False)
+        pipe.exists(key)
+        pipe.sismember(key, str(user_id))
+        exists, is_member = pipe.execute()
+        if exists:
+            return bool(is_member)
+        return str(user_id) in self.members(room_id, loader)
+
+    def add(self, room_id, user_ids):
+        """Record new participants of room_id in both directions."""
+        user_ids = [str(u) for u in user_ids]
+        if not user_ids:
+            return
+        # One round trip however many members join
+        pipe = self.client.pipeline(transaction=False)
+        self._add_if_cached(keys=[f"{ROOM_MEMBERS_PREFIX}{room_id}"], args=user_ids, client=pipe)
+        for user_id in user_ids:
+            self._add_if_cached(keys=[f"{USER_ROOMS_PREFIX}{user_id}"], args=[str(room_id)], client=pipe)
+        pipe.execute()
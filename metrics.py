@@ -0,0 +1,223 @@
+import functools
+import threading
+import time
+
+import redis
+
+import config
+
+ENABLED = config.METRICS_ENABLED
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_registry = []
+_local = threading.local()  # per green thread once eventlet has patched threading
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Prometheus histogram plus bucket-interpolated p50/p95/p99 gauges for a quick read."""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def quantile(self, q, series):
+        count = series[-1]
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for i, bound in enumerate(self.buckets):
+            in_bucket = series[i]
+            if seen + in_bucket >= rank:
+                return lower + (bound - lower) * ((rank - seen) / in_bucket if in_bucket else 0)
+            seen += in_bucket
+            lower = bound
+        return self.buckets[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        quantile_lines = [f"# HELP {self.name}_quantile {self.help} (estimated from buckets)",
+                          f"# TYPE {self.name}_quantile gauge"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += series[i]
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+            for q in QUANTILES:
+                quantile_lines.append(f"{self.name}_quantile{_format_labels(key + (('quantile', q),))} {self.quantile(q, series)}")
+        return lines + quantile_lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time; fn returns a number or {labels_tuple: number}."""
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.fn()
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+socket_event_seconds = Histogram('socket_event_seconds', 'Socket event handler latency')
+socket_event_db_seconds = Histogram('socket_event_db_seconds', 'Time a socket event spent holding DB connections')
+socket_event_emit_seconds = Histogram('socket_event_emit_seconds', 'Time a socket event spent in emit')
+socket_events_total = Counter('socket_events_total', 'Socket events handled')
+socket_event_errors_total = Counter('socket_event_errors_total', 'Socket event handlers that raised')
+db_seconds = Histogram('db_connection_hold_seconds', 'Time between pool checkout and return')
+db_connections_opened_total = Counter('db_connections_opened_total', 'New MySQL connections opened by the pool')
+redis_seconds = Histogram('redis_command_seconds', 'Redis command / pipeline latency')
+
+
+def gauge(name, help_text, fn):
+    return Gauge(name, help_text, fn) if ENABLED else None
+
+
+def _add_local(field, elapsed):
+    current = getattr(_local, field, None)
+    if current is not None:
+        setattr(_local, field, current + elapsed)
+
+
+def record_db(elapsed):
+    db_seconds.observe(elapsed)
+    _add_local('db', elapsed)
+
+
+def record_connection_opened():
+    db_connections_opened_total.inc()
+
+
+def timed_handler(event, handler):
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        _local.db = 0.0
+        _local.emit = 0.0
+        start = time.perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        except Exception:
+            socket_event_errors_total.inc(event=event)
+            raise
+        finally:
+            socket_events_total.inc(event=event)
+            socket_event_seconds.observe(time.perf_counter() - start, event=event)
+            socket_event_db_seconds.observe(_local.db, event=event)
+            socket_event_emit_seconds.observe(_local.emit, event=event)
+            _local.db = _local.emit = None
+    return wrapper
+
+
+def instrument_socketio(socket_io):
+    """
+    Time every handler registered with socket_io.on(...) from here on, and
+    every emit (flask_socketio.emit goes through socket_io.emit too).
+    Nothing is wrapped when metrics are disabled.
+    """
+    if not ENABLED:
+        return
+    on, emit = socket_io.on, socket_io.emit
+
+    def instrumented_on(message, namespace=None):
+        def decorator(handler):
+            return on(message, namespace)(timed_handler(message, handler))
+        return decorator
+
+    def instrumented_emit(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return emit(*args, **kwargs)
+        finally:
+            _add_local('emit', time.perf_counter() - start)
+
+    socket_io.on = instrumented_on
+    socket_io.emit = instrumented_emit
+
+
+class _TimedPipeline(redis.client.Pipeline):
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            redis_seconds.observe(time.perf_counter() - start, command='PIPELINE')
+
+
+class InstrumentedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        if not ENABLED:
+            return super().execute_command(*args, **options)
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            redis_seconds.observe(time.perf_counter() - start, command=str(args[0]).upper())
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        if not ENABLED:
+            return super().pipeline(transaction, shard_hint)
+        return _TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
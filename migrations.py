@@ -0,0 +1,181 @@
+import time
+
+import pymysql
+
+from db import get_db_connection
+from models import BASELINE_STATEMENTS
+
+LOCK_NAME = "chatapp_schema_migrations"
+LOCK_TIMEOUT = 60  # seconds a worker waits for another worker's migration run
+
+SCHEMA_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at DATETIME(6) DEFAULT CURRENT_TIMESTAMP(6)
+    );
+"""
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) AS n FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone()['n'] > 0
+
+
+def index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT COUNT(*) AS n FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index))
+    return cursor.fetchone()['n'] > 0
+
+
+def add_index(cursor, table, index, definition):
+    if not index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE {table} ADD {definition}")
+
+
+# Databases created by the old create_all_tables() may already have some of
+# these changes, so every migration checks before it alters.
+
+def baseline(cursor):
+    for statement in BASELINE_STATEMENTS:
+        cursor.execute(statement)
+
+
+def private_room_pair_key(cursor):
+    if not column_exists(cursor, 'chat_rooms', 'pair_key'):
+        cursor.execute("ALTER TABLE chat_rooms ADD COLUMN pair_key VARCHAR(32) DEFAULT NULL")
+        # One key per user pair; if duplicate rooms already exist the oldest one keeps it
+        cursor.execute("""
+            UPDATE chat_rooms cr
+            JOIN (
+                SELECT MIN(rp1.room_id) AS room_id, CONCAT(rp1.user_id, ':', rp2.user_id) AS pair_key
+                FROM room_participants rp1
+                JOIN room_participants rp2 ON rp1.room_id = rp2.room_id AND rp1.user_id < rp2.user_id
+                JOIN chat_rooms c ON c.id = rp1.room_id AND c.is_group = FALSE
+                WHERE rp1.room_id != 0
+                GROUP BY rp1.user_id, rp2.user_id
+            ) p ON p.room_id = cr.id
+            SET cr.pair_key = p.pair_key
+        """)
+    add_index(cursor, 'chat_rooms', 'uq_pair_key', "UNIQUE KEY uq_pair_key (pair_key)")
+
+
+def pagination_indexes(cursor):
+    # Keyset pagination walks messages by (room_id, id) and unread rows by (user_id, message_id)
+    add_index(cursor, 'messages', 'idx_room_id_id', "INDEX idx_room_id_id (room_id, id)")
+    add_index(cursor, 'message_status', 'idx_user_msg', "INDEX idx_user_msg (user_id, message_id)")
+
+
+def read_watermarks(cursor):
+    if not column_exists(cursor, 'room_participants', 'last_read_message_id'):
+        cursor.execute("""
+            ALTER TABLE room_participants
+            ADD COLUMN last_read_message_id BIGINT NOT NULL DEFAULT 0,
+            ADD COLUMN last_delivered_message_id BIGINT NOT NULL DEFAULT 0
+        """)
+
+
+def message_fulltext_index(cursor):
+    # InnoDB FULLTEXT index: maintained on every INSERT, queried with MATCH ... AGAINST
+    add_index(cursor, 'messages', 'ft_message', "FULLTEXT INDEX ft_message (message)")
+
+
+def attachment_url_index(cursor):
+    # Download access checks look attachments up by file_url
+    add_index(cursor, 'attachments', 'idx_file_url', "INDEX idx_file_url (file_url)")
+
+
+# Append only; never renumber or edit an applied migration.
+MIGRATIONS = [
+    (1, "baseline tables", baseline),
+    (2, "chat_rooms.pair_key for private rooms", private_room_pair_key),
+    (3, "keyset pagination indexes", pagination_indexes),
+    (4, "room_participants read/delivered watermarks", read_watermarks),
+    (5, "FULLTEXT index on messages.message", message_fulltext_index),
+    (6, "attachments.file_url index", attachment_url_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cursor):
+    try:
+        cursor.execute("SELECT MAX(version) AS version FROM schema_version")
+    except pymysql.err.ProgrammingError as e:
+        if e.args[0] == 1146:  # table doesn't exist yet
+            return 0
+        raise
+    return cursor.fetchone()['version'] or 0
+
+
+def migrate():
+    """
+    Bring the schema up to LATEST_VERSION on one connection. When the schema
+    is current this is a single SELECT; otherwise an advisory lock makes sure
+    only one of N booting workers applies the pending migrations while the
+    rest wait (however long that takes) and then see the new version.
+    """
+    started = time.perf_counter()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if current_version(cursor) >= LATEST_VERSION:
+                return
+            while True:
+                cursor.execute("SELECT GET_LOCK(%s, %s) AS locked", (LOCK_NAME, LOCK_TIMEOUT))
+                if cursor.fetchone()['locked']:
+                    break
+                # A long migration holds the lock past LOCK_TIMEOUT; keep waiting
+                # unless it has finished. End the read snapshot to see its version.
+                conn.commit()
+                if current_version(cursor) >= LATEST_VERSION:
+                    return
+                print(f"⏳ Still waiting for the {LOCK_NAME} lock")
+            try:
+                cursor.execute(SCHEMA_VERSION_TABLE)
+                version = current_version(cursor)
+                for number, description, apply in MIGRATIONS:
+                    if number <= version:
+                        continue
+                    apply(cursor)
+                    cursor.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                        (number, description),
+                    )
+                    conn.commit()
+                    print(f"✅ Applied migration {number}: {description}")
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+    print(f"✅ Schema at version {LATEST_VERSION} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+
+
+def migrate_message_status_to_watermarks():
+    """
+    One-off backfill before switching UNREAD_MODEL to 'watermark'. Each
+    watermark becomes the id just below the user's oldest unread (or
+    undelivered) message in the room, or the room's latest message when
+    nothing is outstanding. message_status is left in place.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            for column, pending in (('last_read_message_id', "ms.status != 'read'"),
+                                    ('last_delivered_message_id', "ms.status = 'sent'")):
+                cursor.execute(f"""
+                    UPDATE room_participants rp
+                    SET rp.{column} = COALESCE(
+                        (SELECT MIN(ms.message_id) - 1 FROM message_status ms
+                         JOIN messages m ON m.id = ms.message_id
+                         WHERE ms.user_id = rp.user_id AND m.room_id = rp.room_id AND {pending}),
+                        (SELECT COALESCE(MAX(m.id), 0) FROM messages m WHERE m.room_id = rp.room_id)
+                    )
+                """)
+            conn.commit()
+    print("✅ Read/delivered watermarks backfilled from message_status.")
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,20 @@
+try:
+    from eventlet import tpool
+except ImportError:
+    tpool = None
+
+
+def offload(fn, *args):
+    """
+    Run fn in eventlet's OS thread pool so CPU-heavy or blocking work
+    (hashing, big file reads) does not stall every green thread on the
+    worker. Runs inline when eventlet isn't available.
+    """
+    if tpool is None:
+        return fn(*args)
+    return tpool.execute(fn, *args)
+
+
+def set_pool_size(threads):
+    if tpool is not None and threads:
+        tpool.set_num_threads(threads)
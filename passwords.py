@@ -0,0 +1,57 @@
+import base64
+import hashlib
+import hmac
+import os
+
+import config
+from offload import set_pool_size
+
+SCHEME = "scrypt"
+
+set_pool_size(config.PASSWORD_HASH_THREADS)
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode()
+
+
+def _derive(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=32)
+
+
+def hash_password(password):
+    """Stored as 'scrypt$<n>$<r>$<p>$<salt>$<hash>'. CPU-heavy: call through offload()."""
+    n, r, p = 2 ** config.PASSWORD_SCRYPT_LOG_N, config.PASSWORD_SCRYPT_R, config.PASSWORD_SCRYPT_P
+    salt = os.urandom(16)
+    return f"{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(_derive(password, salt, n, r, p))}"
+
+
+def _dummy_hash():
+    # Current cost settings and a hash no password derives to; never matches
+    n, r, p = 2 ** config.PASSWORD_SCRYPT_LOG_N, config.PASSWORD_SCRYPT_R, config.PASSWORD_SCRYPT_P
+    return f"{SCHEME}${n}${r}${p}${_b64(os.urandom(16))}${_b64(bytes(32))}"
+
+
+# Verified against for unknown usernames, so a miss costs the same KDF time as a wrong password
+DUMMY_HASH = _dummy_hash()
+
+
+def verify_password(password, stored):
+    """
+    Checks password against a stored hash. Rows written before hashing was
+    introduced hold the plaintext and are compared as such (see needs_rehash).
+    """
+    if not stored.startswith(SCHEME + "$"):
+        return hmac.compare_digest(password.encode(), stored.encode())
+    _, n, r, p, salt, expected = stored.split("$")
+    actual = _derive(password, base64.b64decode(salt), int(n), int(r), int(p))
+    return hmac.compare_digest(actual, base64.b64decode(expected))
+
+
+def needs_rehash(stored):
+    """True for legacy plaintext rows and hashes made with other cost settings."""
+    if not stored.startswith(SCHEME + "$"):
+        return True
+    _, n, r, p, _, _ = stored.split("$")
+    return (int(n), int(r), int(p)) != (2 ** config.PASSWORD_SCRYPT_LOG_N, config.PASSWORD_SCRYPT_R, config.PASSWORD_SCRYPT_P)
+
@@ -0,0 +1,48 @@
+import json
+
+PENDING_KEY_PREFIX = "pending:"         # pending:<user_id> -> list of JSON chat payloads, oldest first
+DRAIN_LOCK_PREFIX = "pending_drain:"    # pending_drain:<user_id> -> held by the socket draining the list
+
+
+class PendingDeliveries:
+    """
+    Per-user queue of chat payloads sent while the user was offline, kept in
+    Redis so it survives until they connect to any worker. The list is capped
+    at max_len (oldest dropped; they are still in MySQL for fetch_unread) and
+    expires ttl seconds after the last push.
+    """
+
+    def __init__(self, client, max_len, ttl):
+        self.client = client
+        self.max_len = max_len
+        self.ttl = ttl
+
+    def _key(self, user_id):
+        return f"{PENDING_KEY_PREFIX}{user_id}"
+
+    def push(self, user_id, payload):
+        key = self._key(user_id)
+        pipe = self.client.pipeline()
+        pipe.rpush(key, json.dumps(payload, default=str))
+        pipe.ltrim(key, -self.max_len, -1)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def peek(self, user_id, count):
+        """(first `count` payloads, total queued) without removing anything."""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.lrange(self._key(user_id), 0, count - 1)
+        pipe.llen(self._key(user_id))
+        items, total = pipe.execute()
+        return [json.loads(item) for item in items], total
+
+    def ack(self, user_id, count):
+        """Drop the first `count` payloads once the client confirmed them."""
+        self.client.ltrim(self._key(user_id), count, -1)
+
+    def lock(self, user_id, timeout):
+        """Only one socket drains a user's list at a time, across workers."""
+        return bool(self.client.set(f"{DRAIN_LOCK_PREFIX}{user_id}", 1, nx=True, ex=max(1, int(timeout))))
+
+    def unlock(self, user_id):
+        self.client.delete(f"{DRAIN_LOCK_PREFIX}{user_id}")
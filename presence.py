@@ -0,0 +1,250 @@
+import os
+import socket
+
+ONLINE_USERS_KEY = "online_users"
+PRESENCE_KEY_PREFIX = "presence:"  # presence:<userid> -> hash of sid -> worker id
+WORKER_KEY_PREFIX = "presence_worker:"  # presence_worker:<worker id> -> exists while that worker heartbeats
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Drop the sids of workers whose liveness key expired (crashed without cleaning up)
+_PRUNE_DEAD_SIDS = """
+local function prune(key, worker_prefix)
+    local sids = redis.call('HGETALL', key)
+    for i = 1, #sids, 2 do
+        if redis.call('EXISTS', worker_prefix .. sids[i + 1]) == 0 then
+            redis.call('HDEL', key, sids[i])
+        end
+    end
+end
+"""
+
+# KEYS: presence hash, online set, worker key. ARGV: sid, worker id, ttl, userid, worker key prefix.
+_ADD_SCRIPT = _PRUNE_DEAD_SIDS + """
+redis.call('SET', KEYS[3], 1, 'EX', ARGV[3])
+prune(KEYS[1], ARGV[5])
+local added = redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[4])
+-- Came online: a new sid (HSET returns 0 for one already there) that is the only one
+if added == 1 and redis.call('HLEN', KEYS[1]) == 1 then
+    return 1
+end
+return 0
+"""
+
+# KEYS: presence hash, online set. ARGV: sid, userid, worker key prefix.
+_REMOVE_SCRIPT = _PRUNE_DEAD_SIDS + """
+redis.call('HDEL', KEYS[1], ARGV[1])
+prune(KEYS[1], ARGV[3])
+if redis.call('HLEN', KEYS[1]) == 0 then
+    redis.call('SREM', KEYS[2], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# KEYS: presence hash. ARGV: worker key prefix, ttl.
+_REFRESH_SCRIPT = _PRUNE_DEAD_SIDS + """
+prune(KEYS[1], ARGV[1])
+if redis.call('HLEN', KEYS[1]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def user_room(userid):
+    """SocketIO room every sid of a user joins, on whichever worker it lives."""
+    return f"user:{userid}"
+
+
+def room_channel(room_id):
+    """SocketIO room joined by every online participant of a chat room."""
+    return f"room:{room_id}"
+
+
+class LocalPresence:
+    """
+    This worker's sockets, indexed both ways (userid -> set of sids and
+    sid -> userid) so register and disconnect are O(1) and a user can be
+    connected from several devices at once.
+    """
+
+    def __init__(self):
+        self._sids_by_user = {}
+        self._user_by_sid = {}
+
+    def register(self, userid, sid):
+        """Bind sid to userid. Returns True if it is the user's first sid on this worker."""
+        previous = self._user_by_sid.get(sid)
+        if previous == userid:
+            return False
+        if previous is not None:
+            self.unregister(sid)
+        self._user_by_sid[sid] = userid
+        sids = self._sids_by_user.setdefault(userid, set())
+        sids.add(sid)
+        return len(sids) == 1
+
+    def unregister(self, sid):
+        """
+        Forget sid. Returns (userid, last_local_sid), or (None, False) if the
+        sid never registered.
+        """
+        userid = self._user_by_sid.pop(sid, None)
+        if userid is None:
+            return None, False
+        sids = self._sids_by_user.get(userid)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids_by_user[userid]
+                return userid, True
+        return userid, False
+
+    def user_for(self, sid):
+        return self._user_by_sid.get(sid)
+
+    def sids(self, userid):
+        return set(self._sids_by_user.get(userid, ()))
+
+    def userids(self):
+        return list(self._sids_by_user)
+
+    def __len__(self):
+        return len(self._user_by_sid)
+
+
+class RedisPresence:
+    """
+    Cluster-wide presence shared by all workers: one hash per user holding
+    that user's sids (and the worker of each), plus the online_users set.
+    Each worker keeps a liveness key alive from its heartbeat; sids of a
+    worker whose key expired are pruned on add, remove and heartbeat, so a
+    crashed worker's sids don't keep a user online after their last live sid
+    leaves. Hash keys expire too, for users with no live sid anywhere.
+    """
+
+    def __init__(self, client, ttl, worker_id=WORKER_ID):
+        self.client = client
+        self.ttl = ttl
+        self.worker_id = worker_id
+        self._add = client.register_script(_ADD_SCRIPT)
+        self._remove = client.register_script(_REMOVE_SCRIPT)
+        self._refresh = client.register_script(_REFRESH_SCRIPT)
+        self._heartbeat_started = False
+
+    def _key(self, userid):
+        return f"{PRESENCE_KEY_PREFIX}{userid}"
+
+    def _worker_key(self):
+        return f"{WORKER_KEY_PREFIX}{self.worker_id}"
+
+    def add(self, userid, sid):
+        """
+        Returns True if sid is new and the user's only sid on any worker, i.e.
+        they just came online. Re-adding a sid already there returns False.
+        """
+        return self._add(
+            keys=[self._key(userid), ONLINE_USERS_KEY, self._worker_key()],
+            args=[sid, self.worker_id, self.ttl, userid, WORKER_KEY_PREFIX],
+        ) == 1
+
+    def remove(self, userid, sid):
+        """Returns True if that was the user's last live sid on any worker."""
+        return bool(self._remove(
+            keys=[self._key(userid), ONLINE_USERS_KEY],
+            args=[sid, userid, WORKER_KEY_PREFIX],
+        ))
+
+    def is_online(self, userid):
+        return bool(self.client.exists(self._key(userid)))
+
+    def online_page(self, cursor=0, count=100):
+        """
+        One SSCAN page of the online set as (next_cursor, userids); next_cursor
+        is 0 once the scan is complete. Members whose presence hash expired
+        (crashed worker) are dropped from the set on the way.
+        """
+        cursor, members = self.client.sscan(ONLINE_USERS_KEY, cursor=cursor, count=count)
+        members = list(members)
+        if not members:
+            return cursor, []
+        alive = self.online_among(members)
+        stale = [m for m in members if m not in alive]
+        if stale:
+            self.client.srem(ONLINE_USERS_KEY, *stale)
+        return cursor, [m for m in members if m in alive]
+
+    def online_among(self, userids):
+        """Subset of userids that currently have a live presence hash."""
+        pipe = self.client.pipeline(transaction=False)
+        for userid in userids:
+            pipe.exists(self._key(userid))
+        return {str(u) for u, alive in zip(userids, pipe.execute()) if alive}
+
+    def refresh(self, userids):
+        """Heartbeat: keep this worker alive and the given users' hashes, minus dead sids."""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(self._worker_key(), 1, ex=self.ttl)
+        for userid in userids:
+            self._refresh(keys=[self._key(userid)], args=[WORKER_KEY_PREFIX, self.ttl], client=pipe)
+        pipe.execute()
+
+    def ensure_heartbeat(self, start_background_task, sleep, local_userids):
+        """Keep this worker's presence keys alive; local_userids() lists users with a sid here."""
+        if self._heartbeat_started:
+            return
+        self._heartbeat_started = True
+
+        def heartbeat():
+            while True:
+                sleep(self.ttl / 3)
+                try:
+                    self.refresh(list(local_userids()))
+                except Exception as e:
+                    print(f"Redis error during presence heartbeat: {e}")
+
+        start_background_task(heartbeat)
+
+
+class PresenceBatcher:
+    """
+    Coalesces presence changes per SocketIO room and emits them as a single
+    'presence' event ({'online': [...], 'offline': [...]}) per room every
+    interval, instead of one event per change.
+    """
+
+    def __init__(self, emit, interval):
+        self.emit = emit
+        self.interval = interval
+        self._pending = {}  # room -> {userid: online}
+        self._started = False
+
+    def add(self, userid, online, rooms):
+        for room in rooms:
+            self._pending.setdefault(room, {})[userid] = online
+
+    def ensure_started(self, start_background_task, sleep):
+        if self._started:
+            return
+        self._started = True
+
+        def run():
+            while True:
+                sleep(self.interval)
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Presence batch error: {e}")
+
+        start_background_task(run)
+
+    def flush(self):
+        pending, self._pending = self._pending, {}
+        for room, changes in pending.items():
+            self.emit('presence', {
+                'online': [u for u, online in changes.items() if online],
+                'offline': [u for u, online in changes.items() if not online],
+            }, to=room)
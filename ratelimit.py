@@ -0,0 +1,88 @@
+import threading
+import time
+
+from cache import LRUCache
+
+
+class TokenBucketLimiter:
+    """
+    In-process token buckets keyed by client (IP, user, ...): `rate` tokens
+    per second up to `burst`. Buckets of idle clients fall out of the LRU.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = LRUCache(max_keys)  # key -> [tokens, last refill time]
+        self._lock = threading.Lock()
+
+    def allow(self, key, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [self.burst, now]
+                self._buckets.set(key, bucket)
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < cost:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - cost
+            return True
+
+
+# KEYS[1] bucket hash; ARGV: rate, burst, cost. Time comes from the Redis
+# server so every worker refills against the same clock.
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return allowed
+"""
+
+
+class RedisTokenBucketLimiter:
+    """
+    The same token bucket kept in Redis, so a limit holds across workers.
+    A bucket expires once it would have refilled completely anyway.
+    """
+
+    def __init__(self, client, rate, burst, prefix="ratelimit:"):
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self._script = client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    def allow(self, key, cost=1):
+        return bool(self._script(keys=[f"{self.prefix}{key}"], args=[self.rate, self.burst, cost]))
+
+
+class LayeredLimiter:
+    """
+    In-process bucket first, so a client hammering one worker is refused
+    without a Redis round trip; requests it lets through are then checked
+    against the shared bucket (if any).
+    """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def allow(self, key, cost=1):
+        if not self.local.allow(key, cost):
+            return False
+        return self.shared is None or self.shared.allow(key, cost)
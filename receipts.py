@@ -0,0 +1,47 @@
+import atexit
+
+STATUS_ORDER = ('delivered', 'read')
+
+
+class ReceiptBuffer:
+    """
+    Collects delivery/read receipts per (user, status) for a short window so
+    a client acknowledging a burst of messages costs one set-based write per
+    flush instead of one UPDATE per message.
+    flush_fn(user_id, status, message_ids, watermarks) does the write;
+    watermarks maps room_id -> highest message id acknowledged in that room.
+    """
+
+    def __init__(self, flush_fn, interval):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self._pending = {}  # (user_id, status) -> {'ids': set, 'watermarks': {room_id: up_to}}
+        self._started = False
+
+    def add(self, user_id, status, message_ids=(), room_id=None, up_to=None):
+        pending = self._pending.setdefault((user_id, status), {'ids': set(), 'watermarks': {}})
+        pending['ids'].update(message_ids)
+        if room_id is not None and up_to is not None:
+            pending['watermarks'][room_id] = max(up_to, pending['watermarks'].get(room_id, up_to))
+
+    def ensure_started(self, start_background_task, sleep):
+        if self._started:
+            return
+        self._started = True
+
+        def run():
+            while True:
+                sleep(self.interval)
+                self.flush()
+
+        start_background_task(run)
+        atexit.register(self.flush)
+
+    def flush(self):
+        pending, self._pending = self._pending, {}
+        # 'delivered' first so a read in the same window is never downgraded
+        for (user_id, status), receipt in sorted(pending.items(), key=lambda kv: STATUS_ORDER.index(kv[0][1])):
+            try:
+                self.flush_fn(user_id, status, sorted(receipt['ids']), receipt['watermarks'])
+            except Exception as e:
+                print(f"❌ Failed to write {status} receipts for user {user_id}: {e}")
@@ -0,0 +1,132 @@
+import json
+
+USER_ROOMS_BY_TIME_PREFIX = "user_rooms_by_time:"  # user_rooms_by_time:<user_id> -> zset room_id scored by last activity
+ROOM_SUMMARY_PREFIX = "room_summary:"              # room_summary:<room_id> -> hash, see RoomIndex
+LOADED_MEMBER = "_loaded"                          # scored -1 so it sorts after every room
+PREVIEW_LENGTH = 100
+
+# Move a room up a user's list, only if the list was loaded and only forward in time
+_BUMP_IF_LOADED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    local current = redis.call('ZSCORE', KEYS[1], ARGV[1])
+    if not current or tonumber(current) < tonumber(ARGV[2]) then
+        redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+    end
+end
+return 0
+"""
+
+# Replace the last-message fields unless the hash already has a newer message
+_UPDATE_SUMMARY_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], 'last_message_id')) or -1
+if current < tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 0
+"""
+
+
+class RoomIndex:
+    """
+    Conversation list in Redis: per user, their rooms ordered by last
+    activity, and per room a summary hash (name, is_group, member_names for
+    private rooms, last message preview, sender, id and time). Both are
+    filled from MySQL on a miss and kept current from the message write
+    path, so a page of the list costs a ZREVRANGE plus one HGETALL per room.
+    Summaries only answer reads once the static fields were loaded ('loaded').
+    """
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+        self._bump_if_loaded = client.register_script(_BUMP_IF_LOADED_SCRIPT)
+        self._update_summary = client.register_script(_UPDATE_SUMMARY_SCRIPT)
+
+    def _user_key(self, user_id):
+        return f"{USER_ROOMS_BY_TIME_PREFIX}{user_id}"
+
+    def _summary_key(self, room_id):
+        return f"{ROOM_SUMMARY_PREFIX}{room_id}"
+
+    def record_message(self, room_id, member_ids, message):
+        """message: the room's newest saved entry (id, sender_id, message, created_at)."""
+        score = message['created_at'].timestamp()
+        # Pipelined so a large group costs one round trip, not one per member
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in member_ids:
+            self._bump_if_loaded(keys=[self._user_key(user_id)], args=[room_id, score], client=pipe)
+        self._set_last_message(room_id, message, client=pipe)
+        pipe.execute()
+
+    def _set_last_message(self, room_id, message, client=None):
+        fields = {
+            'last_message_id': message['id'],
+            'last_sender_id': message['sender_id'],
+            'last_message': (message['message'] or '')[:PREVIEW_LENGTH],
+            'last_message_at': message['created_at'].isoformat(),
+        }
+        args = [self.ttl, message['id']]
+        for field, value in fields.items():
+            args.extend([field, value])
+        self._update_summary(keys=[self._summary_key(room_id)], args=args, client=client)
+
+    def add_room(self, room_id, user_ids, timestamp):
+        """A room the users just joined, placed at `timestamp` in their lists."""
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            self._bump_if_loaded(keys=[self._user_key(user_id)], args=[room_id, timestamp], client=pipe)
+        pipe.execute()
+
+    def page(self, user_id, offset, limit, loader):
+        """
+        ([room_id, ...] newest activity first, has_more); loader() -> {room_id: timestamp}
+        from MySQL when the user's list isn't cached.
+        """
+        key = self._user_key(user_id)
+        if not self.client.exists(key):
+            scores = {str(room_id): ts for room_id, ts in loader().items()}
+            scores[LOADED_MEMBER] = -1
+            pipe = self.client.pipeline()
+            pipe.zadd(key, scores)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        else:
+            self.client.expire(key, self.ttl)
+        room_ids = [r for r in self.client.zrevrange(key, offset, offset + limit) if r != LOADED_MEMBER]
+        return room_ids[:limit], len(room_ids) > limit
+
+    def summaries(self, room_ids, loader):
+        """
+        {room_id: summary dict}; loader(missing_ids) -> {room_id: (static_fields, last_message or None)}
+        for rooms whose summary isn't cached.
+        """
+        pipe = self.client.pipeline(transaction=False)
+        for room_id in room_ids:
+            pipe.hgetall(self._summary_key(room_id))
+        cached = dict(zip(room_ids, pipe.execute()))
+        missing = [room_id for room_id, summary in cached.items() if not summary.get('loaded')]
+        if missing:
+            for room_id, (static, last_message) in loader(missing).items():
+                room_id = str(room_id)
+                key = self._summary_key(room_id)
+                pipe = self.client.pipeline()
+                pipe.hset(key, mapping=dict(static, member_names=json.dumps(static.get('member_names') or {}), loaded=1))
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+                if last_message:
+                    self._set_last_message(room_id, last_message)
+                cached[room_id] = self.client.hgetall(key)
+        return {room_id: self._decode(summary) for room_id, summary in cached.items() if summary}
+
+    @staticmethod
+    def _decode(summary):
+        return {
+            'name': summary.get('name') or None,
+            'is_group': summary.get('is_group') == '1',
+            'member_names': json.loads(summary.get('member_names') or '{}'),
+            'last_message_id': int(summary['last_message_id']) if summary.get('last_message_id') else None,
+            'last_sender_id': int(summary['last_sender_id']) if summary.get('last_sender_id') else None,
+            'last_message': summary.get('last_message'),
+            'last_message_at': summary.get('last_message_at'),
+        }
@@ -0,0 +1,259 @@
+from flask import Blueprint, request, jsonify, send_file
+from db import get_db_connection, redis_client
+from offload import offload
+from routes.auth import token_verifier
+import config
+import hashlib
+import os
+import re
+import time
+import uuid
+
+attachments_bp = Blueprint('attachments', __name__)
+
+UPLOAD_KEY_PREFIX = "upload:"           # upload:<id> -> hash of user_id, mime_type
+UPLOAD_LOCK_PREFIX = "upload_lock:"     # upload_lock:<id> -> held while a chunk is appended or the upload completes
+USER_UPLOADS_PREFIX = "user_uploads:"   # user_uploads:<user_id> -> zset of open upload ids scored by expiry time
+OBJECT_META_PREFIX = "attachment_meta:"  # attachment_meta:<sha256> -> hash of mime_type, size
+OBJECT_OWNERS_PREFIX = "attachment_owners:"  # attachment_owners:<sha256> -> set of user ids who uploaded it
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def upload_path(upload_id):
+    return os.path.join(config.ATTACHMENT_ROOT, 'tmp', upload_id)
+
+
+def object_path(sha256):
+    # Content-addressed: identical files share one object
+    return os.path.join(config.ATTACHMENT_ROOT, 'objects', sha256[:2], sha256)
+
+
+def object_url(sha256):
+    return f"/attachments/{sha256}"
+
+
+def object_meta(sha256):
+    """{'mime_type', 'size'} of a stored object, or None if it doesn't exist."""
+    if not SHA256_RE.match(sha256 or '') or not os.path.exists(object_path(sha256)):
+        return None
+    meta = redis_client.hgetall(f"{OBJECT_META_PREFIX}{sha256}")
+    return {
+        'mime_type': meta.get('mime_type') or 'application/octet-stream',
+        'size': int(meta.get('size') or os.path.getsize(object_path(sha256))),
+    }
+
+
+def can_access(user_id, sha256):
+    """
+    The uploader, or a participant of a room where the object was sent.
+    Knowing the hash (it is in every chat payload) is not enough.
+    """
+    if redis_client.sismember(f"{OBJECT_OWNERS_PREFIX}{sha256}", str(user_id)):
+        return True
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT 1 FROM attachments a
+                JOIN messages m ON m.id = a.message_id
+                JOIN room_participants rp ON rp.room_id = m.room_id AND rp.user_id = %s
+                WHERE a.file_url = %s
+                LIMIT 1
+            """, (user_id, object_url(sha256)))
+            return cursor.fetchone() is not None
+
+
+def authenticated_user():
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header[len('Bearer '):] if auth_header.startswith('Bearer ') else None
+    return token_verifier.verify(token)
+
+
+def load_upload(upload_id, user_id):
+    if not UPLOAD_ID_RE.match(upload_id):
+        return None
+    upload = redis_client.hgetall(f"{UPLOAD_KEY_PREFIX}{upload_id}")
+    if not upload or upload.get('user_id') != user_id:
+        return None
+    return upload
+
+
+_next_sweep = 0.0
+
+
+def sweep_stale_uploads():
+    """
+    Delete tmp files of uploads abandoned for longer than ATTACHMENT_UPLOAD_TTL.
+    Every chunk touches the file and refreshes the upload key, so a file that
+    old belongs to an upload key that has already expired.
+    """
+    cutoff = time.time() - config.ATTACHMENT_UPLOAD_TTL
+    try:
+        entries = list(os.scandir(os.path.join(config.ATTACHMENT_ROOT, 'tmp')))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # completed or swept by another worker meanwhile
+
+
+def maybe_sweep_stale_uploads():
+    global _next_sweep
+    now = time.monotonic()
+    if now < _next_sweep:
+        return
+    _next_sweep = now + config.ATTACHMENT_SWEEP_INTERVAL
+    try:
+        offload(sweep_stale_uploads)
+    except OSError as e:
+        print(f"❌ Failed to sweep abandoned uploads: {e}")
+
+
+def reserve_upload_slot(user_id, upload_id):
+    """Count upload_id against the user's open uploads; False if they already have too many."""
+    key = f"{USER_UPLOADS_PREFIX}{user_id}"
+    now = time.time()
+    pipe = redis_client.pipeline()
+    pipe.zremrangebyscore(key, '-inf', now)  # expired uploads no longer count
+    pipe.zadd(key, {upload_id: now + config.ATTACHMENT_UPLOAD_TTL})
+    pipe.zcard(key)
+    pipe.expire(key, config.ATTACHMENT_UPLOAD_TTL)
+    open_uploads = pipe.execute()[2]
+    if open_uploads > config.ATTACHMENT_MAX_OPEN_UPLOADS:
+        redis_client.zrem(key, upload_id)
+        return False
+    return True
+
+
+def lock_upload(upload_id):
+    """One request at a time may append to or complete an upload."""
+    return bool(redis_client.set(f"{UPLOAD_LOCK_PREFIX}{upload_id}", 1, nx=True, ex=config.ATTACHMENT_UPLOAD_LOCK_TTL))
+
+
+def unlock_upload(upload_id):
+    redis_client.delete(f"{UPLOAD_LOCK_PREFIX}{upload_id}")
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@attachments_bp.route('/attachments/uploads', methods=['POST'])
+def start_upload():
+    user_id = authenticated_user()
+    if not user_id:
+        return jsonify({"success": "false", "message": "Unauthorized"}), 401
+    maybe_sweep_stale_uploads()
+    data = request.get_json(silent=True) or {}
+    upload_id = uuid.uuid4().hex
+    if not reserve_upload_slot(user_id, upload_id):
+        return jsonify({"success": "false", "message": "Too many unfinished uploads"}), 429
+    os.makedirs(os.path.dirname(upload_path(upload_id)), exist_ok=True)
+    open(upload_path(upload_id), 'wb').close()
+    key = f"{UPLOAD_KEY_PREFIX}{upload_id}"
+    redis_client.hset(key, mapping={
+        'user_id': user_id,
+        'mime_type': data.get('mime_type') or 'application/octet-stream',
+    })
+    redis_client.expire(key, config.ATTACHMENT_UPLOAD_TTL)
+    return jsonify({"success": "true", "content": {"upload_id": upload_id, "received": 0}}), 201
+
+
+@attachments_bp.route('/attachments/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    user_id = authenticated_user()
+    if not user_id or not load_upload(upload_id, user_id):
+        return jsonify({"success": "false", "message": "Unknown upload"}), 404
+    return jsonify({"success": "true", "content": {"upload_id": upload_id, "received": os.path.getsize(upload_path(upload_id))}}), 200
+
+
+@attachments_bp.route('/attachments/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    Append the request body at X-Upload-Offset. The body is streamed to disk
+    in ATTACHMENT_CHUNK_SIZE pieces, never held whole in memory. A client that
+    lost its connection asks GET .../<upload_id> for 'received' and resumes
+    from there.
+    """
+    user_id = authenticated_user()
+    if not user_id or not load_upload(upload_id, user_id):
+        return jsonify({"success": "false", "message": "Unknown upload"}), 404
+    # Two PUTs at the same offset would both pass the offset check and interleave
+    if not lock_upload(upload_id):
+        return jsonify({"success": "false", "message": "Upload busy"}), 409
+    try:
+        path = upload_path(upload_id)
+        received = os.path.getsize(path)
+        offset = int(request.headers.get('X-Upload-Offset', received))
+        if offset != received:
+            return jsonify({"success": "false", "message": "Offset mismatch", "content": {"received": received}}), 409
+        with open(path, 'ab') as f:
+            while True:
+                chunk = request.stream.read(config.ATTACHMENT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > config.ATTACHMENT_MAX_SIZE:
+                    f.truncate(offset)
+                    return jsonify({"success": "false", "message": "File too large"}), 413
+                f.write(chunk)
+    finally:
+        unlock_upload(upload_id)
+    redis_client.expire(f"{UPLOAD_KEY_PREFIX}{upload_id}", config.ATTACHMENT_UPLOAD_TTL)
+    redis_client.zadd(f"{USER_UPLOADS_PREFIX}{user_id}", {upload_id: time.time() + config.ATTACHMENT_UPLOAD_TTL}, xx=True)
+    return jsonify({"success": "true", "content": {"upload_id": upload_id, "received": received}}), 200
+
+
+@attachments_bp.route('/attachments/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    user_id = authenticated_user()
+    upload = load_upload(upload_id, user_id) if user_id else None
+    if not upload:
+        return jsonify({"success": "false", "message": "Unknown upload"}), 404
+    if not lock_upload(upload_id):
+        return jsonify({"success": "false", "message": "Upload busy"}), 409
+    try:
+        path = upload_path(upload_id)
+        sha256 = offload(sha256_file, path)
+        size = os.path.getsize(path)
+        target = object_path(sha256)
+        if os.path.exists(target):
+            os.remove(path)  # already stored: dedupe
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+        redis_client.hset(f"{OBJECT_META_PREFIX}{sha256}", mapping={'mime_type': upload['mime_type'], 'size': size})
+        redis_client.sadd(f"{OBJECT_OWNERS_PREFIX}{sha256}", user_id)
+        redis_client.delete(f"{UPLOAD_KEY_PREFIX}{upload_id}")
+        redis_client.zrem(f"{USER_UPLOADS_PREFIX}{user_id}", upload_id)
+    finally:
+        unlock_upload(upload_id)
+    return jsonify({"success": "true", "content": {
+        "sha256": sha256,
+        "size": size,
+        "mime_type": upload['mime_type'],
+        "url": object_url(sha256),
+    }}), 200
+
+
+@attachments_bp.route('/attachments/<sha256>', methods=['GET'])
+def download(sha256):
+    user_id = authenticated_user()
+    if not user_id:
+        return jsonify({"success": "false", "message": "Unauthorized"}), 401
+    meta = object_meta(sha256)
+    # Same answer for missing and forbidden, so hashes can't be probed
+    if not meta or not can_access(user_id, sha256):
+        return jsonify({"success": "false", "message": "Not found"}), 404
+    # conditional=True answers Range requests with 206 partial content; with
+    # USE_X_SENDFILE the front proxy streams the file with sendfile
+    response = send_file(object_path(sha256), mimetype=meta['mime_type'], conditional=True, etag=sha256)
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
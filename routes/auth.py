@@ -1,12 +1,46 @@
 from flask import Blueprint, request, jsonify
-from db import get_db_connection
+from db import get_db_connection, redis_client
+from offload import offload
+from passwords import DUMMY_HASH, hash_password, needs_rehash, verify_password
+from tokens import TokenVerifier
+from cache import TTLCache
+from ratelimit import TokenBucketLimiter
+from taken_names import TakenNames
+import config
 import pymysql
 import jwt
 import datetime
 
-SECRET_KEY = "your-very-secret-key"
+SECRET_KEY = config.JWT_SECRET_KEY
+token_verifier = TokenVerifier(SECRET_KEY, redis_client, config.TOKEN_CACHE_SIZE)
 auth_bp = Blueprint('auth', __name__)
 
+
+def load_taken_names():
+    with get_db_connection() as conn:
+        with conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute("SELECT username, email FROM users")
+            for row in cursor:
+                yield row['username']
+                yield row['email']
+
+
+taken_names = TakenNames(
+    redis_client,
+    load_taken_names,
+    capacity=config.TAKEN_NAMES_BLOOM_CAPACITY,
+    error_rate=config.TAKEN_NAMES_BLOOM_ERROR_RATE,
+    rebuild_interval=config.TAKEN_NAMES_REBUILD_INTERVAL,
+)
+# casefolded name -> True; only 'taken' is cached, since a name free here may be
+# registered on another worker at any moment
+exist_cache = TTLCache(100000, config.CHECK_EXIST_CACHE_TTL)
+
+
+def exist_cache_key(name):
+    return name.strip().casefold()
+check_exist_limiter = TokenBucketLimiter(config.CHECK_EXIST_RATE, config.CHECK_EXIST_BURST)
+
 @auth_bp.route('/register', methods=['POST'])
 def register_credential():
     data = request.get_json()
@@ -24,16 +58,20 @@ def register_credential():
     dob = data['dob']
 
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            query = """
-                INSERT INTO users (username, password, email, gender, dob)
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            cursor.execute(query, (username, password, email, gender, dob))
-            user_id = cursor.lastrowid
-            conn.commit()
-        conn.close()
+        # Hash outside the connection checkout so a slow hash doesn't hold a pooled connection
+        password = offload(hash_password, password)
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                query = """
+                    INSERT INTO users (username, password, email, gender, dob)
+                    VALUES (%s, %s, %s, %s, %s)
+                """
+                cursor.execute(query, (username, password, email, gender, dob))
+                user_id = cursor.lastrowid
+                conn.commit()
+        taken_names.add(username, email)
+        exist_cache.set(exist_cache_key(username), True)
+        exist_cache.set(exist_cache_key(email), True)
 
         return jsonify({
             "success": "true",
@@ -58,22 +96,36 @@ def verify_email_usage():
 
     if not data or 'username' not in data:
         return jsonify({"success": "false", "message": "Missing data"}), 400
+    if not check_exist_limiter.allow(request.remote_addr):
+        return jsonify({"success": "false", "message": "Too many requests"}), 429
     username = data['username']
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            query = "SELECT id FROM users WHERE username=%s or email=%s"
-            cursor.execute(query, (username, username))
-            result = cursor.fetchone()
-            conn.close()
-
-            if result:
-                return jsonify({
-                    "success": "false",
-                    "message": "User already Exist",
-                }), 401
+        result = exist_cache.get(exist_cache_key(username))
+        if result is None:
+            if taken_names.might_be_taken(username) is False:
+                result = False
             else:
-                return jsonify({"success": "true", "message": "New User Found!"}), 401
+                # Possible hit (or filter still building): confirm with two unique-index lookups
+                with get_db_connection() as conn:
+                    with conn.cursor() as cursor:
+                        query = """
+                            SELECT id FROM users WHERE username=%s
+                            UNION ALL
+                            SELECT id FROM users WHERE email=%s
+                            LIMIT 1
+                        """
+                        cursor.execute(query, (username, username))
+                        result = cursor.fetchone() is not None
+            if result:
+                exist_cache.set(exist_cache_key(username), True)
+
+        if result:
+            return jsonify({
+                "success": "false",
+                "message": "User already Exist",
+            }), 401
+        else:
+            return jsonify({"success": "true", "message": "New User Found!"}), 401
 
     except Exception as e:
         return jsonify({"success": "false", "message": str(e)}), 500
@@ -94,31 +146,54 @@ def login_credential():
     password = data['password']
 
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            query = "SELECT id, username FROM users WHERE username=%s AND password=%s"
-            cursor.execute(query, (username, password))
-            result = cursor.fetchone()
-            conn.close()
-
-            if result:
-                # Generate JWT token
-                payload = {
-                    'user_id': result['id'],
-                    'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                query = "SELECT id, username, password FROM users WHERE username=%s"
+                cursor.execute(query, (username,))
+                result = cursor.fetchone()
+
+        if result is None:
+            # Unknown username: pay for the KDF anyway so timing doesn't reveal which names exist
+            offload(verify_password, password, DUMMY_HASH)
+        elif not offload(verify_password, password, result['password']):
+            result = None
+        if result and needs_rehash(result['password']):
+            # Legacy plaintext row or old cost settings: upgrade the stored hash transparently
+            new_hash = offload(hash_password, password)
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("UPDATE users SET password=%s WHERE id=%s", (new_hash, result['id']))
+                    conn.commit()
+
+        if result:
+            # Generate JWT token
+            payload = {
+                'user_id': result['id'],
+                'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
+            }
+            token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+            return jsonify({
+                "success": "true",
+                "message": "Login successful",
+                "content": {
+                    "userid": result['id'],
+                    "username": result['username'],
+                    "token": token
                 }
-                token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
-                return jsonify({
-                    "success": "true",
-                    "message": "Login successful",
-                    "content": {
-                        "userid": result['id'],
-                        "username": result['username'],
-                        "token": token
-                    }
-                }), 200
-            else:
-                return jsonify({"success": "false", "message": "Invalid credentials"}), 401
+            }), 200
+        else:
+            return jsonify({"success": "false", "message": "Invalid credentials"}), 401
 
     except Exception as e:
         return jsonify({"success": "false", "message": str(e)}), 500
+
+
+@auth_bp.route('/logout', methods=['POST'])
+def logout():
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header[len('Bearer '):] if auth_header.startswith('Bearer ') else None
+    if not token:
+        return jsonify({"success": "false", "message": "Missing bearer token"}), 400
+    if not token_verifier.revoke(token):
+        return jsonify({"success": "false", "message": "Invalid token"}), 401
+    return jsonify({"success": "true", "message": "Logged out"}), 200
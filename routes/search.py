@@ -0,0 +1,102 @@
+from flask import Blueprint, request, jsonify
+from flask_socketio import emit
+from db import get_db_connection
+from routes.attachments import authenticated_user
+from routes.websocket import (MESSAGE_COLUMNS, connected_users, event_limiters, limiter_allows, rate_limited,
+                              serialize_message, socket_io)
+import config
+import re
+
+search_bp = Blueprint('search', __name__)
+
+# Characters with a meaning in BOOLEAN MODE; stripped so user input is only words
+BOOLEAN_OPERATORS_RE = re.compile(r'[+\-<>()~*"@]+')
+
+
+def boolean_query(text):
+    """'hello wor' -> '+hello* +wor*': every word required, each as a prefix."""
+    words = BOOLEAN_OPERATORS_RE.sub(' ', text or '').split()
+    return ' '.join(f"+{word}*" for word in words[:10])
+
+
+def search_messages(user_id, text, limit, offset=0, room_id=None):
+    """
+    Messages matching text in rooms user_id belongs to, best match first
+    (newest first among equal scores). Uses the ft_message FULLTEXT index;
+    the join on room_participants limits matches to the user's rooms.
+    Returns (messages, has_more).
+    """
+    query = boolean_query(text)
+    if not query:
+        return [], False
+    room_filter = "AND m.room_id = %s" if room_id is not None else ""
+    params = [query, user_id, query]
+    if room_id is not None:
+        params.append(int(room_id))
+    params.extend([limit + 1, offset])
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {MESSAGE_COLUMNS}, MATCH(m.message) AGAINST (%s IN BOOLEAN MODE) AS score
+                FROM messages m
+                JOIN room_participants rp ON rp.room_id = m.room_id AND rp.user_id = %s
+                WHERE MATCH(m.message) AGAINST (%s IN BOOLEAN MODE) AND m.is_deleted = FALSE {room_filter}
+                ORDER BY score DESC, m.id DESC
+                LIMIT %s OFFSET %s
+            """, params)
+            rows = cursor.fetchall()
+    return rows[:limit], len(rows) > limit
+
+
+def search_page(data):
+    """(limit, offset) from request data, or None when the offset is too deep."""
+    limit = max(1, min(int(data.get('limit') or config.SEARCH_PAGE_DEFAULT), config.SEARCH_PAGE_MAX))
+    offset = max(0, int(data.get('offset') or 0))
+    if offset > config.SEARCH_MAX_OFFSET:
+        return None
+    return limit, offset
+
+
+def search_response(user_id, data):
+    page = search_page(data)
+    if page is None:
+        return {"success": False, "message": "Offset too large; narrow the search"}
+    limit, offset = page
+    messages, has_more = search_messages(user_id, data.get('q'), limit, offset, data.get('room_id'))
+    return {
+        "success": True,
+        "messages": [serialize_message(m) for m in messages],
+        "has_more": has_more,
+        "next_offset": offset + len(messages),
+    }
+
+
+@socket_io.on('search_messages')
+@rate_limited('search_messages')
+def handle_search_messages(data):
+    """{'q': 'dinner friday', 'room_id': 5 (optional), 'limit': 20, 'offset': 0}"""
+    user_id = connected_users.user_for(request.sid)
+    if not user_id:
+        emit('search_messages_response', {"success": False, "message": "Register first"}, to=request.sid)
+        return
+    try:
+        emit('search_messages_response', search_response(int(user_id), data or {}), to=request.sid)
+    except Exception as e:
+        emit('search_messages_response', {"success": False, "message": str(e)}, to=request.sid)
+
+
+@search_bp.route('/search', methods=['GET'])
+def search():
+    user_id = authenticated_user()
+    if not user_id:
+        return jsonify({"success": "false", "message": "Unauthorized"}), 401
+    limiter = event_limiters.get('search_messages')
+    if limiter and not limiter_allows(limiter, user_id):
+        return jsonify({"success": "false", "message": "Too many requests"}), 429
+    try:
+        result = search_response(int(user_id), request.args)
+    except Exception as e:
+        return jsonify({"success": "false", "message": str(e)}), 500
+    ok = result["success"]
+    result["success"] = "true" if ok else "false"
+    return jsonify(result), 200 if ok else 400
@@ -1,64 +1,233 @@
 from flask import Blueprint, request
-from flask_socketio import SocketIO, emit
-from db import get_db_connection
+from flask_socketio import SocketIO, emit, join_room, rooms
+from db import get_db_connection, redis_client
+from routes.attachments import can_access, object_meta, object_url
+from membership import RoomMembership
+from receipts import ReceiptBuffer
+from unread import UnreadCounters
+from pending import PendingDeliveries
+from history_cache import RecentHistory
+from room_index import RoomIndex
+from tokens import TokenVerifier
+from presence import LocalPresence, PresenceBatcher, RedisPresence, room_channel, user_room
+from write_behind import WriteBehindQueue
+from cache import LRUCache
+from ratelimit import LayeredLimiter, RedisTokenBucketLimiter, TokenBucketLimiter
+from backpressure import OutboundWatchdog
+import config
+import metrics
+import datetime
+import functools
+import pymysql
 import redis
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
-ONLINE_USERS_KEY = "online_users"
-connected_users = {}
+import threading
+connected_users = LocalPresence()  # sockets on this worker only
+authenticated_sids = set()  # sids that presented a valid JWT on connect
+token_verifier = TokenVerifier(config.JWT_SECRET_KEY, redis_client, config.TOKEN_CACHE_SIZE)
+presence = RedisPresence(redis_client, config.PRESENCE_TTL)
+membership = RoomMembership(redis_client, config.MEMBERSHIP_CACHE_TTL)
+unread_counters = UnreadCounters(redis_client, config.UNREAD_CACHE_TTL)
+recent_history = RecentHistory(redis_client, config.ROOM_HISTORY_CACHE_SIZE, config.ROOM_HISTORY_CACHE_TTL)
+room_index = RoomIndex(redis_client, config.ROOM_INDEX_TTL)
+pending_deliveries = PendingDeliveries(redis_client, config.PENDING_MAX_LEN, config.PENDING_TTL)
 socket_io = SocketIO()  # Do NOT pass app here; do it in app.py
+# Before any @socket_io.on below so every handler and emit is timed
+metrics.instrument_socketio(socket_io)
+metrics.gauge('online_sockets', 'Sockets connected to this worker', lambda: len(connected_users))
+presence_batcher = PresenceBatcher(socket_io.emit, config.PRESENCE_COALESCE_INTERVAL)
 ws_chat_bp = Blueprint('ws_chat', __name__)
+event_limiters = {
+    event: LayeredLimiter(
+        TokenBucketLimiter(rate, burst),
+        RedisTokenBucketLimiter(redis_client, rate, burst, prefix=f"ratelimit:{event}:")
+        if config.SOCKET_RATE_LIMIT_SHARED else None,
+    )
+    for event, (rate, burst) in config.SOCKET_RATE_LIMITS.items()
+}
+broadcast_limiter = RedisTokenBucketLimiter(redis_client, config.BROADCAST_RATE, config.BROADCAST_BURST,
+                                            prefix="ratelimit:broadcast:")
+outbound_watchdog = OutboundWatchdog(lambda: socket_io.server.eio, config.SOCKET_MAX_OUTBOUND_QUEUE,
+                                     config.OUTBOUND_CHECK_INTERVAL)
+receipt_buffer = ReceiptBuffer(
+    lambda user_id, status, message_ids, watermarks: mark_messages_status(user_id, status, message_ids, watermarks),
+    interval=config.RECEIPT_COALESCE_INTERVAL,
+)
+private_room_cache = LRUCache(config.PRIVATE_ROOM_CACHE_SIZE)  # 'low_id:high_id' -> room_id
+message_writer = WriteBehindQueue(
+    lambda batch: save_messages_to_db(batch),
+    batch_size=config.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=config.WRITE_BEHIND_FLUSH_INTERVAL,
+    max_queue=config.WRITE_BEHIND_MAX_QUEUE,
+    put_timeout=config.WRITE_BEHIND_PUT_TIMEOUT,
+)
+
+def limiter_allows(limiter, key):
+    try:
+        return limiter.allow(key)
+    except redis.RedisError as re:
+        print(f"Redis error in rate limiter: {re}")
+        return True  # fail open; a layered limiter's in-process bucket already passed
+def rate_limited(event):
+    """
+    Refuse the event with a 'rate_limited' reply once the user (or the bare
+    sid before register) exceeds SOCKET_RATE_LIMITS[event].
+    """
+    limiter = event_limiters.get(event)
+
+    def decorator(handler):
+        if limiter is None:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            key = connected_users.user_for(request.sid) or request.sid
+            if not limiter_allows(limiter, key):
+                emit('rate_limited', {'event': event}, to=request.sid)
+                return None
+            return handler(*args, **kwargs)
+        return wrapper
+    return decorator
 
 @socket_io.on('connect')
-def on_connect():
+def on_connect(auth=None):
+    outbound_watchdog.ensure_started(socket_io.start_background_task, socket_io.sleep)
+    token = (auth or {}).get('token') or request.args.get('token')
+    if token:
+        try:
+            userid = token_verifier.verify(token)
+        except redis.RedisError as re:
+            print(f"Redis error verifying token on connect: {re}")
+            return False
+        if not userid:
+            print(f"Rejected connection with invalid token: {request.sid}")
+            return False
+        # Authenticated once here; no users-table write on connect
+        authenticated_sids.add(request.sid)
+        try:
+            register_socket(userid, request.sid)
+        except redis.RedisError as re:
+            print(f"Redis error on connect: {re}")
+            return False
+        emit('register_response', {
+            "success": "true",
+            "message": "WebSocket ID registered successfully!",
+            "content": {
+                "userid": userid,
+                "ws_id": request.sid
+            }
+        })
+    elif config.SOCKET_AUTH_REQUIRED:
+        return False
     print(f"Client connected: {request.sid}")
 
 @socket_io.on('disconnect')
-def on_disconnect():
+def on_disconnect(reason=None):
     sid = request.sid
-    userid = None
-    for uid, user_sid in list(connected_users.items()):
-        if user_sid == sid:
-            userid = uid
-            del connected_users[uid]
-            break
+    authenticated_sids.discard(sid)
+    userid, _ = connected_users.unregister(sid)
     if userid:
         try:
-            redis_client.srem(ONLINE_USERS_KEY, userid)
-            # Broadcast updated online users list
-            online_users = list(redis_client.smembers(ONLINE_USERS_KEY))
-            emit('online_users', online_users, broadcast=True)
+            # Offline only once the user's last sid on any worker is gone
+            if presence.remove(userid, sid):
+                room_channels = [r for r in rooms(sid) if r.startswith('room:')]
+                announce_presence(userid, False, room_channels)
         except redis.RedisError as re:
             print(f"Redis error on disconnect: {re}")
     print(f"User disconnected: {userid if userid else sid}")
+def register_socket(userid, sid):
+    """
+    Bind sid to userid on this worker and in shared presence, join the user's
+    SocketIO rooms and announce them if they just came online.
+    """
+    previous = connected_users.user_for(sid)
+    connected_users.register(userid, sid)
+    join_room(user_room(userid))
+    if previous is not None and previous != userid:
+        presence.remove(previous, sid)
+    came_online = presence.add(userid, sid)
+    presence.ensure_heartbeat(socket_io.start_background_task, socket_io.sleep, connected_users.userids)
+    # Join this user's chat rooms and tell those rooms they came online
+    room_channels = [room_channel(room_id) for room_id in get_user_room_ids(userid)]
+    for channel in room_channels:
+        join_room(channel)
+    if came_online:
+        announce_presence(userid, True, room_channels)
+    if previous != userid:
+        # After register_response: push whatever arrived while they were offline
+        socket_io.start_background_task(drain_pending, userid, sid)
+
+def drain_pending(userid, sid):
+    """
+    Emit the user's offline queue to this socket as 'pending_messages'
+    chunks, oldest first: {'messages': [...], 'remaining': n}. A chunk is
+    removed only when the client acknowledges it (the event's callback); if
+    no ack arrives within PENDING_ACK_TIMEOUT it stays queued for the next
+    connect or 'fetch_pending'.
+    """
+    while connected_users.user_for(sid) == userid:
+        if not pending_deliveries.lock(userid, config.PENDING_ACK_TIMEOUT + 5):
+            return  # another socket of this user is draining
+        try:
+            messages, total = pending_deliveries.peek(userid, config.PENDING_CHUNK_SIZE)
+            if not messages:
+                return
+            acked = threading.Event()
+            socket_io.emit('pending_messages', {'messages': messages, 'remaining': total - len(messages)},
+                           to=sid, callback=lambda *args: acked.set())
+            if not acked.wait(config.PENDING_ACK_TIMEOUT):
+                return
+            pending_deliveries.ack(userid, len(messages))
+        except redis.RedisError as re:
+            print(f"❌ Redis error draining pending messages: {re}")
+            return
+        finally:
+            pending_deliveries.unlock(userid)
+
+@socket_io.on('fetch_pending')
+@rate_limited('fetch_pending')
+def handle_fetch_pending(data=None):
+    userid = connected_users.user_for(request.sid)
+    if userid:
+        drain_pending(userid, request.sid)
 @socket_io.on('register')
+@rate_limited('register')
 def handle_register(data):
-    userid = data.get('userid') or data.get('id')
+    bound = connected_users.user_for(request.sid)
+    userid = data.get('userid') or data.get('id') or bound
     if not userid:
         emit('register_response', {
             "success": "false",
             "message": "Missing userid"
         })
         return
-    connected_users[userid] = request.sid
-    # Add user to Redis set with error handling
-    try:
-        redis_client.sadd(ONLINE_USERS_KEY, userid)
-    except redis.RedisError as re:
+    userid = str(userid)
+    if bound is not None and request.sid in authenticated_sids:
+        # Already authenticated from the JWT on connect
+        if userid != bound:
+            emit('register_response', {"success": "false", "message": "userid does not match token"})
+            return
         emit('register_response', {
-            "success": "false",
-            "message": f"Redis error: {str(re)}"
+            "success": "true",
+            "message": "WebSocket ID registered successfully!",
+            "content": {
+                "userid": userid,
+                "ws_id": request.sid
+            }
         })
         return
+    if config.SOCKET_AUTH_REQUIRED:
+        emit('register_response', {"success": "false", "message": "Connect with a token to register"})
+        return
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            query = "UPDATE users SET ws_id = %s WHERE id = %s"
-            cursor.execute(query, (request.sid, userid))
-            conn.commit()
-            updated = cursor.rowcount
-        conn.close()
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                query = "UPDATE users SET ws_id = %s WHERE id = %s"
+                cursor.execute(query, (request.sid, userid))
+                conn.commit()
+                updated = cursor.rowcount
 
         if updated:
+            register_socket(userid, request.sid)
             emit('register_response', {
                 "success": "true",
                 "message": "WebSocket ID registered successfully!",
@@ -67,26 +236,106 @@ def handle_register(data):
                     "ws_id": request.sid
                 }
             })
-            # Broadcast updated online users list with error handling
-            try:
-                online_users = list(redis_client.smembers(ONLINE_USERS_KEY))
-                emit('online_users', online_users, broadcast=True)
-            except redis.RedisError as re:
-                print(f"Redis error during broadcast: {re}")
         else:
             emit('register_response', {
                 "success": "false",
                 "message": "Invalid userid!"
             })
+    except redis.RedisError as re:
+        emit('register_response', {
+            "success": "false",
+            "message": f"Redis error: {str(re)}"
+        })
     except Exception as e:
         emit('register_response', {
             "success": "false",
             "message": str(e)
         })
+def get_user_room_ids(user_id):
+    return membership.rooms_of(user_id, lambda: load_user_room_ids(user_id))
+def load_user_room_ids(user_id):
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT room_id FROM room_participants WHERE user_id = %s AND room_id != 0
+            """, (user_id,))
+            return [row['room_id'] for row in cursor.fetchall()]
+def load_room_member_ids(room_id):
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT user_id FROM room_participants WHERE room_id = %s
+            """, (room_id,))
+            return [row['user_id'] for row in cursor.fetchall()]
+def announce_presence(userid, online, room_channels):
+    """
+    Send a user_online/user_offline delta to the rooms the user shares with
+    others, or queue it for the next coalesced 'presence' event.
+    """
+    if not room_channels:
+        return  # an empty target list would broadcast to everyone
+    if config.PRESENCE_COALESCE_INTERVAL > 0:
+        presence_batcher.ensure_started(socket_io.start_background_task, socket_io.sleep)
+        presence_batcher.add(userid, online, room_channels)
+        return
+    socket_io.emit('user_online' if online else 'user_offline', {'userid': userid}, to=room_channels)
+@socket_io.on('get_online_users')
+@rate_limited('get_online_users')
+def handle_get_online_users(data):
+    """
+    Snapshot for newly connected clients.
+    scope 'contacts' (default): which of the user's room co-members are online, paged by offset.
+    scope 'all': one SSCAN page of everyone online, paged by the returned cursor.
+    """
+    data = data or {}
+    userid = connected_users.user_for(request.sid)
+    if not userid:
+        emit('get_online_users_response', {"success": False, "message": "Register first"}, to=request.sid)
+        return
+    count = min(int(data.get('count', 100)), config.ONLINE_USERS_PAGE_MAX)
+    try:
+        if data.get('scope') == 'all':
+            cursor, users = presence.online_page(int(data.get('cursor', 0)), count)
+            emit('get_online_users_response', {
+                "success": True, "scope": "all", "users": users, "cursor": cursor
+            }, to=request.sid)
+            return
+        offset = int(data.get('offset', 0))
+        contacts = get_contact_ids(userid)
+        page = contacts[offset:offset + count]
+        next_offset = offset + count if offset + count < len(contacts) else None
+        emit('get_online_users_response', {
+            "success": True,
+            "scope": "contacts",
+            "users": sorted(presence.online_among(page)) if page else [],
+            "next_offset": next_offset,
+        }, to=request.sid)
+    except Exception as e:
+        emit('get_online_users_response', {"success": False, "message": str(e)}, to=request.sid)
+def get_contact_ids(user_id):
+    """Users sharing at least one room with user_id, ordered by id."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT rp2.user_id FROM room_participants rp1
+                JOIN room_participants rp2 ON rp1.room_id = rp2.room_id
+                WHERE rp1.user_id = %s AND rp2.user_id != %s AND rp1.room_id != 0
+                ORDER BY rp2.user_id
+            """, (user_id, user_id))
+            return [str(row['user_id']) for row in cursor.fetchall()]
 @socket_io.on('chat')
+@rate_limited('chat')
 def handle_chat(data):
     try:
-        sender = data.get('from')
+        bound = connected_users.user_for(request.sid)
+        claimed = data.get('from')
+        if bound is not None and claimed is not None and str(claimed) != bound:
+            emit('error', "❌ 'from' does not match the registered user", to=request.sid)
+            return
+        if bound is None and config.SOCKET_AUTH_REQUIRED:
+            emit('error', "❌ Connect with a token to chat", to=request.sid)
+            return
+        sender = bound or claimed
         receiver = data.get('to')
         message = data.get('msg')
 
@@ -94,68 +343,332 @@ def handle_chat(data):
             emit('error', "❌ Invalid payload. Required: from, to, msg", to=request.sid)
             return
 
+        try:
+            receiver_id = 1 if receiver == 'all' else int(receiver)
+        except (TypeError, ValueError):
+            receiver_id = None
+        problem = invalid_message(receiver_id, message)
+        if problem:
+            emit('error', f"❌ {problem}", to=request.sid)
+            return
+
         payload = {'from': sender, 'to': receiver, 'msg': message}
 
         if receiver == 'all':
+            if not limiter_allows(broadcast_limiter, 'all'):
+                emit('rate_limited', {'event': 'chat', 'to': 'all'}, to=request.sid)
+                return
             emit('chat', payload, broadcast=True)
-            save_message_to_db(int(sender), 1, message)  # Store in admin chat
+            persist_message(int(sender), receiver_id, message)  # Store in admin chat
         else:
             # Always store the message in the DB
-            save_message_to_db(int(sender), int(receiver), message)
-            # If recipient is online, emit the message
-            if str(receiver) in connected_users:
-                receiver_sid = connected_users[str(receiver)]
-                emit('chat', payload, to=receiver_sid)
-                emit('chat', payload, to=request.sid)
+            entry = persist_message(int(sender), receiver_id, message)
+            if entry is not None and entry.get('id') is not None:
+                # Written synchronously: clients can ack it by message_id or {room_id, up_to}
+                # and dedupe it against fetch_unread
+                payload.update(message_id=entry['id'], room_id=entry['room_id'])
+            # If recipient is online on any worker, emit to their user room
+            if presence.is_online(receiver):
+                # One emit: the packet is encoded once for both targets
+                emit('chat', payload, to=[user_room(receiver), request.sid])
+            elif entry is None:
+                # Never stored, so don't queue it for delivery either
+                emit('error', "❌ Message could not be saved", to=request.sid)
             else:
-                emit('status', f"⚠️ {receiver} is not online, message stored in DB", to=request.sid)
+                pending_deliveries.push(receiver, dict(payload, sent_at=entry['created_at'].isoformat()))
+                if presence.is_online(receiver):
+                    # Came online between the two checks and may have drained already
+                    emit('pending_available', {}, to=user_room(receiver))
+                emit('status', f"⚠️ {receiver} is not online, message queued for delivery", to=request.sid)
 
     except Exception as e:
         print(f"❌ Chat error: {e}")
         emit('error', 'Something went wrong', to=request.sid)
-def save_message_to_db(sender_id, receiver_id, message):
+MAX_MESSAGE_BYTES = 65535  # messages.message is TEXT
+
+def invalid_message(receiver_id, message, room_id=None):
+    """
+    Why a message can't be stored, or None. Checked before a message is
+    queued, since one row MySQL rejects fails its whole write-behind batch.
+    """
+    if room_id is None and not (isinstance(receiver_id, int) and receiver_id > 0):
+        return "Invalid receiver"
+    if not isinstance(message, str):
+        return "Message must be text"
+    if len(message.encode('utf-8')) > MAX_MESSAGE_BYTES:
+        return f"Message longer than {MAX_MESSAGE_BYTES} bytes"
+    return None
+def persist_message(sender_id, receiver_id, message, room_id=None):
+    """
+    Store a chat message, either right away or through the write-behind
+    queue when WRITE_BEHIND_ENABLED is set. Group messages pass room_id
+    and no receiver_id. Returns the entry (with id and room_id once written),
+    or None if a synchronous write failed. Raises ValueError for a message
+    invalid_message rejects.
+    """
+    problem = invalid_message(receiver_id, message, room_id)
+    if problem:
+        raise ValueError(problem)
+    if not config.WRITE_BEHIND_ENABLED:
+        return save_message_to_db(sender_id, receiver_id, message, room_id)
+    message_writer.ensure_started(socket_io.start_background_task)
+    entry = {
+        'sender_id': sender_id,
+        'receiver_id': receiver_id,
+        'room_id': room_id,
+        'message': message,
+        'created_at': datetime.datetime.now(),
+    }
+    if not message_writer.submit(entry):
+        # Queue stayed full for put_timeout: write this one synchronously
+        try:
+            save_messages_to_db([entry])
+        except Exception as e:
+            print(f"❌ Failed to save message to DB: {e}")
+            return None
+    return entry
+def save_message_to_db(sender_id, receiver_id, message, room_id=None):
+    entry = {
+        'sender_id': sender_id,
+        'receiver_id': receiver_id,
+        'room_id': room_id,
+        'message': message,
+        'created_at': datetime.datetime.now(),
+    }
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            room_id = get_or_create_private_room(sender_id, receiver_id, cursor)
-            cursor.execute("""
-                INSERT INTO messages (room_id, sender_id, message)
-                VALUES (%s, %s, %s)
-            """, (room_id, sender_id, message))
-            # Update last_message_at in chat_rooms
-            cursor.execute("""
-                UPDATE chat_rooms SET last_message_at = NOW(6) WHERE id = %s
-            """, (room_id,))
-            conn.commit()
-        conn.close()
+        save_messages_to_db([entry])
+        return entry
     except Exception as e:
         print(f"❌ Failed to save message to DB: {e}")
+def save_messages_to_db(entries):
+    """
+    entries: dicts with sender_id, message, created_at and either room_id
+    (group messages) or receiver_id (private messages); optionally type and
+    attachment ({url, mime_type, size}). Writes them with multi-row INSERTs and one last_message_at update per
+    room, then fills in each entry's room_id and id.
+    Ids are taken from LAST_INSERT_ID(). InnoDB hands out consecutive ids to
+    a single plain multi-row INSERT in every innodb_autoinc_lock_mode
+    (including MySQL 8's default of 2), so each INSERT is kept under
+    PyMySQL's max_stmt_length (see insert_chunks) to stay one statement.
+    """
+    rooms = {}
+    try:
+        _write_messages(entries, rooms)
+    except Exception:
+        # A room created in the failed transaction was rolled back with it;
+        # forget it in the cache and in the entries so a retry resolves the room again
+        for sender_id, receiver_id in rooms:
+            user1, user2 = sorted([int(sender_id), int(receiver_id)])
+            private_room_cache.pop(f"{user1}:{user2}")
+        for entry in entries:
+            entry.pop('id', None)
+            if entry.get('receiver_id') is not None:
+                entry['room_id'] = None
+        raise
+    if config.ROOM_HISTORY_CACHE_SIZE > 0:
+        try:
+            recent_history.append([serialize_message(message_row(e)) for e in entries])
+        except redis.RedisError as re:
+            print(f"Redis error updating history cache: {re}")
+    try:
+        index_room_activity(entries)
+    except redis.RedisError as re:
+        print(f"Redis error updating room index: {re}")
+    if config.UNREAD_MODEL == 'watermark':
+        try:
+            count_unread(entries)
+        except redis.RedisError as re:
+            print(f"Redis error updating unread counters: {re}")
+    return entries
+def index_room_activity(entries):
+    """Move each room up its members' conversation lists and refresh its summary."""
+    latest = {}
+    for entry in entries:
+        if entry['room_id'] not in latest or entry['id'] > latest[entry['room_id']]['id']:
+            latest[entry['room_id']] = entry
+    for room_id, entry in latest.items():
+        members = membership.members(room_id, lambda: load_room_member_ids(room_id))
+        room_index.record_message(room_id, members, entry)
+def count_unread(entries):
+    senders_by_room = {}
+    for entry in entries:
+        senders_by_room.setdefault(entry['room_id'], []).append(str(entry['sender_id']))
+    counts = {}
+    # Members once per room, not per message
+    for room_id, senders in senders_by_room.items():
+        members = membership.members(room_id, lambda: load_room_member_ids(room_id))
+        for uid in members:
+            n = sum(1 for sender in senders if sender != uid)
+            if n:
+                counts[(uid, room_id)] = n
+    unread_counters.incr(counts)
+def _write_messages(entries, rooms):
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            for entry in entries:
+                if entry.get('room_id') is not None:
+                    continue
+                pair = (entry['sender_id'], entry['receiver_id'])
+                if pair not in rooms:
+                    rooms[pair] = get_or_create_private_room(pair[0], pair[1], cursor)
+                entry['room_id'] = rooms[pair]
+            for chunk in insert_chunks(entries, cursor.max_stmt_length):
+                cursor.executemany("""
+                    INSERT INTO messages (room_id, sender_id, message, type, created_at)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, [(e['room_id'], e['sender_id'], e['message'], e.get('type', 'text'), e['created_at']) for e in chunk])
+                if cursor.rowcount != len(chunk):
+                    raise RuntimeError(f"Expected {len(chunk)} inserted rows, got {cursor.rowcount}")
+                first_id = cursor.lastrowid
+                for offset, entry in enumerate(chunk):
+                    entry['id'] = first_id + offset
+            attachments = [e for e in entries if e.get('attachment')]
+            if attachments:
+                cursor.executemany("""
+                    INSERT INTO attachments (message_id, file_url, mime_type, file_size)
+                    VALUES (%s, %s, %s, %s)
+                """, [(e['id'], e['attachment']['url'], e['attachment']['mime_type'], e['attachment']['size'])
+                      for e in attachments])
+            if config.UNREAD_MODEL == 'status':
+                # One 'sent' status row per recipient so receipts and fetch_unread have rows to work on
+                ids = [e['id'] for e in entries]
+                cursor.execute(f"""
+                    INSERT IGNORE INTO message_status (message_id, user_id, status)
+                    SELECT m.id, rp.user_id, 'sent' FROM messages m
+                    JOIN room_participants rp ON rp.room_id = m.room_id AND rp.user_id != m.sender_id
+                    WHERE m.id IN ({','.join(['%s'] * len(ids))})
+                """, ids)
+            # Update last_message_at in chat_rooms, once per room
+            last_message_at = {}
+            for entry in entries:
+                room_id = entry['room_id']
+                last_message_at[room_id] = max(last_message_at.get(room_id, entry['created_at']), entry['created_at'])
+            cursor.executemany("""
+                UPDATE chat_rooms SET last_message_at = %s WHERE id = %s
+            """, [(ts, room_id) for room_id, ts in last_message_at.items()])
+            conn.commit()
+INSERT_ROW_OVERHEAD = 128  # bytes per row besides the message: ids, type, timestamp, quotes, commas
+
+def insert_chunks(entries, max_stmt_length):
+    """
+    Split entries so each chunk's multi-row INSERT fits in max_stmt_length
+    bytes even if every message byte needs escaping. PyMySQL would otherwise
+    split the statement itself, and lastrowid would only cover the last part.
+    """
+    budget = max_stmt_length - 256  # INSERT ... VALUES prefix
+    chunk, size = [], 0
+    for entry in entries:
+        row = 2 * len((entry['message'] or '').encode('utf-8')) + INSERT_ROW_OVERHEAD
+        if chunk and size + row > budget:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(entry)
+        size += row
+    if chunk:
+        yield chunk
+
 def get_or_create_private_room(sender_id, receiver_id, cursor):
     # Always order IDs to ensure unique room for a pair
     user1, user2 = sorted([int(sender_id), int(receiver_id)])
-    cursor.execute("""
-        SELECT rp1.room_id FROM room_participants rp1
-        JOIN room_participants rp2 ON rp1.room_id = rp2.room_id
-        WHERE rp1.user_id = %s AND rp2.user_id = %s AND rp1.room_id != 0
-        LIMIT 1
-    """, (user1, user2))
+    pair_key = f"{user1}:{user2}"
+    room_id = private_room_cache.get(pair_key)
+    if room_id is not None:
+        return room_id
+    cursor.execute("SELECT id FROM chat_rooms WHERE pair_key = %s", (pair_key,))
     result = cursor.fetchone()
     if result:
-        return result['room_id']
-    # Create room
-    cursor.execute("INSERT INTO chat_rooms (created_by) VALUES (%s);", (user1,))
+        private_room_cache.set(pair_key, result['id'])
+        return result['id']
+    # Create room; the unique pair_key makes a concurrent creator's row win
+    # and LAST_INSERT_ID(id) hands back whichever room exists
+    cursor.execute("""
+        INSERT INTO chat_rooms (created_by, pair_key) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+    """, (user1, pair_key))
     new_room_id = cursor.lastrowid
     cursor.execute("""
         INSERT IGNORE INTO room_participants (room_id, user_id) VALUES
         (%s, %s), (%s, %s)
     """, (new_room_id, user1, new_room_id, user2))
+    private_room_cache.set(pair_key, new_room_id)
+    membership.add(new_room_id, [user1, user2])
     return new_room_id
 
 
+def attachment_message_type(mime_type):
+    kind = mime_type.split('/', 1)[0]
+    return kind if kind in ('image', 'video', 'audio') else 'file'
+@socket_io.on('attachment')
+@rate_limited('attachment')
+def handle_attachment(data):
+    """
+    Send a file uploaded through /attachments/uploads. The socket carries only
+    the reference: {'to': 7 | 'room_id': 5, 'sha256': ..., 'msg': optional caption}.
+    """
+    try:
+        # Access is checked against the sender, so it must come from the socket, never the payload
+        sender = connected_users.user_for(request.sid)
+        receiver = data.get('to')
+        room_id = data.get('room_id')
+        meta = object_meta(data.get('sha256'))
+        if not sender:
+            emit('error', "❌ Register first", to=request.sid)
+            return
+        if not (receiver or room_id):
+            emit('error', "❌ Invalid payload. Required: to or room_id, sha256", to=request.sid)
+            return
+        # Forwarding needs access too, or any known hash could be shared into a new room
+        if not meta or not can_access(sender, data['sha256']):
+            emit('error', "❌ Unknown attachment", to=request.sid)
+            return
+        if room_id and not membership.is_member(room_id, sender, lambda: load_room_member_ids(room_id)):
+            emit('error', "❌ Not a member of this group", to=request.sid)
+            return
+        attachment = {
+            'url': object_url(data['sha256']),
+            'sha256': data['sha256'],
+            'mime_type': meta['mime_type'],
+            'size': meta['size'],
+        }
+        entry = {
+            'sender_id': int(sender),
+            'receiver_id': int(receiver) if receiver and not room_id else None,
+            'room_id': int(room_id) if room_id else None,
+            'message': data.get('msg') or '',
+            'type': attachment_message_type(meta['mime_type']),
+            'attachment': attachment,
+            'created_at': datetime.datetime.now(),
+        }
+        # Written synchronously: the attachments row needs the message id
+        save_messages_to_db([entry])
+        payload = {'from': sender, 'msg': entry['message'], 'type': entry['type'],
+                   'message_id': entry['id'], 'attachment': attachment}
+        if room_id:
+            payload['room_id'] = entry['room_id']
+            socket_io.emit('chat', payload, to=room_channel(entry['room_id']))
+        else:
+            payload['to'] = receiver
+            emit('chat', payload, to=[user_room(receiver), request.sid])
+    except Exception as e:
+        print(f"❌ Attachment error: {e}")
+        emit('error', 'Something went wrong', to=request.sid)
+
+
 @socket_io.on('create_group')
+@rate_limited('create_group')
 def handle_create_group(data):
     name = data.get('name')
-    created_by = data.get('created_by')
+    bound = connected_users.user_for(request.sid)
+    claimed = data.get('created_by')
+    if bound is not None and claimed is not None and str(claimed) != bound:
+        emit('create_group_response', {"success": False, "message": "created_by does not match the registered user"},
+             to=request.sid)
+        return
+    if bound is None and config.SOCKET_AUTH_REQUIRED:
+        emit('create_group_response', {"success": False, "message": "Connect with a token to create groups"},
+             to=request.sid)
+        return
+    created_by = bound or claimed
     user_ids = data.get('user_ids')  # List of user IDs
     if not name or not created_by or not user_ids or not isinstance(user_ids, list):
         emit('create_group_response', {"success": False, "message": "Missing or invalid data"}, to=request.sid)
@@ -168,100 +681,450 @@ def create_group_chat_room(name, created_by, user_ids):
     created_by: User ID of creator
     user_ids: List of user IDs to add (including creator)
     """
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        # Create the group chat room
-        cursor.execute("""
-            INSERT INTO chat_rooms (name, created_by, is_group)
-            VALUES (%s, %s, TRUE)
-        """, (name, created_by))
-        room_id = cursor.lastrowid
-
-        # Add all users to room_participants
-        values = ','.join(['(%s, %s)'] * len(user_ids))
-        params = []
-        for uid in user_ids:
-            params.extend([room_id, uid])
-        cursor.execute(f"""
-            INSERT IGNORE INTO room_participants (room_id, user_id)
-            VALUES {values}
-        """, params)
-        conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            # Create the group chat room
+            cursor.execute("""
+                INSERT INTO chat_rooms (name, created_by, is_group)
+                VALUES (%s, %s, TRUE)
+            """, (name, created_by))
+            room_id = cursor.lastrowid
+
+            # Add all users to room_participants
+            values = ','.join(['(%s, %s)'] * len(user_ids))
+            params = []
+            for uid in user_ids:
+                params.extend([room_id, uid])
+            cursor.execute(f"""
+                INSERT IGNORE INTO room_participants (room_id, user_id)
+                VALUES {values}
+            """, params)
+            conn.commit()
+    membership.add(room_id, user_ids)
+    room_index.add_room(room_id, user_ids, datetime.datetime.now().timestamp())
+    join_group_channel(room_id, user_ids)
     return room_id
 
 def add_user_to_group(room_id, user_id):
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        cursor.execute("""
-            INSERT IGNORE INTO room_participants (room_id, user_id)
-            VALUES (%s, %s)
-        """, (room_id, user_id))
-        conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            # Start the watermarks at the room's latest message so earlier history isn't unread
+            cursor.execute("""
+                INSERT IGNORE INTO room_participants (room_id, user_id, last_read_message_id, last_delivered_message_id)
+                SELECT %s, %s, COALESCE(MAX(id), 0), COALESCE(MAX(id), 0) FROM messages WHERE room_id = %s
+            """, (room_id, user_id, room_id))
+            conn.commit()
+    membership.add(room_id, [user_id])
+    room_index.add_room(room_id, [user_id], datetime.datetime.now().timestamp())
+    join_group_channel(room_id, [user_id])
+
+def join_group_channel(room_id, user_ids):
+    """
+    Put new members' sockets into the room's SocketIO channel. Sockets on this
+    worker join directly; others get 'group_joined' and reply with 'join_group'.
+    """
+    channel = room_channel(room_id)
+    for uid in user_ids:
+        for sid in connected_users.sids(str(uid)):
+            join_room(channel, sid=sid, namespace='/')
+    if user_ids:  # an empty target list would broadcast to everyone
+        socket_io.emit('group_joined', {'room_id': room_id}, to=[user_room(str(uid)) for uid in user_ids])
+
+@socket_io.on('join_group')
+@rate_limited('join_group')
+def handle_join_group(data):
+    room_id = data.get('room_id')
+    userid = connected_users.user_for(request.sid)
+    if not room_id or not userid:
+        return
+    if membership.is_member(room_id, userid, lambda: load_room_member_ids(room_id)):
+        join_room(room_channel(room_id))
+
+@socket_io.on('group_chat')
+@rate_limited('group_chat')
+def handle_group_chat(data):
+    try:
+        room_id = data.get('room_id')
+        message = data.get('msg')
+        sender = connected_users.user_for(request.sid) or data.get('from')
+        if not sender or not room_id or not message:
+            emit('error', "❌ Invalid payload. Required: from, room_id, msg", to=request.sid)
+            return
+        problem = invalid_message(None, message, room_id)
+        if problem:
+            emit('error', f"❌ {problem}", to=request.sid)
+            return
+        if not membership.is_member(room_id, sender, lambda: load_room_member_ids(room_id)):
+            emit('error', "❌ Not a member of this group", to=request.sid)
+            return
+        handle_group_message(int(sender), int(room_id), message)
+    except Exception as e:
+        print(f"❌ Group chat error: {e}")
+        emit('error', 'Something went wrong', to=request.sid)
 
 def handle_group_message(sender_id, room_id, message):
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        # Store message
-        cursor.execute("""
-            INSERT INTO messages (room_id, sender_id, message)
-            VALUES (%s, %s, %s)
-        """, (room_id, sender_id, message))
-        # Update last_message_at
-        cursor.execute("""
-            UPDATE chat_rooms SET last_message_at = NOW(6) WHERE id = %s
-        """, (room_id,))
-        # Get all participants
-        cursor.execute("""
-            SELECT user_id FROM room_participants WHERE room_id = %s
-        """, (room_id,))
-        participants = [str(row['user_id']) for row in cursor.fetchall()]
-    conn.close()
-    # Emit to all connected users in the group
+    entry = persist_message(sender_id, None, message, room_id=room_id)
+    # One emit to the room channel reaches every online member on every worker
     payload = {'from': sender_id, 'room_id': room_id, 'msg': message}
-    for uid in participants:
-        if uid in connected_users:
-            emit('chat', payload, to=connected_users[uid])
-
+    if entry is not None and entry.get('id') is not None:
+        payload['message_id'] = entry['id']
+    socket_io.emit('chat', payload, to=room_channel(room_id))
 
 
 @socket_io.on('mark_delivered')
+@rate_limited('mark_delivered')
 def handle_mark_delivered(data):
-    message_id = data.get('message_id')
-    user_id = data.get('user_id')
-    if message_id and user_id:
-        mark_message_delivered(message_id, user_id)
+    queue_receipt(data, 'delivered')
 
 @socket_io.on('mark_read')
+@rate_limited('mark_read')
 def handle_mark_read(data):
-    message_id = data.get('message_id')
-    user_id = data.get('user_id')
-    if message_id and user_id:
-        mark_message_read(message_id, user_id)
+    queue_receipt(data, 'read')
+
+def queue_receipt(data, status):
+    """
+    Accepts any of:
+      {'message_id': 12}                  single message (legacy)
+      {'message_ids': [12, 13, 14]}       explicit list
+      {'room_id': 5, 'up_to': 14}         everything in room 5 up to message 14
+    """
+    user_id = connected_users.user_for(request.sid) or data.get('user_id')
+    if not user_id:
+        return
+    message_ids = data.get('message_ids') or ([data['message_id']] if data.get('message_id') else [])
+    message_ids = [int(m) for m in message_ids[:config.RECEIPT_MAX_IDS]]
+    room_id = data.get('room_id')
+    up_to = data.get('up_to')
+    if room_id is not None and up_to is not None:
+        room_id, up_to = int(room_id), int(up_to)
+    else:
+        room_id = up_to = None
+    if not message_ids and room_id is None:
+        return
+    if config.RECEIPT_COALESCE_INTERVAL > 0:
+        receipt_buffer.ensure_started(socket_io.start_background_task, socket_io.sleep)
+        receipt_buffer.add(int(user_id), status, message_ids, room_id, up_to)
+    else:
+        mark_messages_status(int(user_id), status, message_ids, {room_id: up_to} if room_id is not None else {})
+
+def mark_messages_status(user_id, status, message_ids, watermarks):
+    """
+    Set-based receipt write: one INSERT ... ON DUPLICATE KEY UPDATE for the
+    explicit ids and one UPDATE per room watermark. A 'read' row is never
+    downgraded to 'delivered'.
+    """
+    if config.UNREAD_MODEL == 'watermark':
+        advance_watermarks(user_id, status, message_ids, watermarks)
+        return
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if message_ids:
+                # Restricted to rooms the user is in, so no rows appear for someone else's messages
+                cursor.execute(f"""
+                    INSERT INTO message_status (message_id, user_id, status)
+                    SELECT m.id, rp.user_id, %s FROM messages m
+                    JOIN room_participants rp ON rp.room_id = m.room_id AND rp.user_id = %s
+                    WHERE m.id IN ({','.join(['%s'] * len(message_ids))}) AND m.sender_id != rp.user_id
+                    ON DUPLICATE KEY UPDATE status = IF(message_status.status = 'read', 'read', VALUES(status))
+                """, [status, user_id] + list(message_ids))
+            for room_id, up_to in watermarks.items():
+                cursor.execute("""
+                    UPDATE message_status ms
+                    JOIN messages m ON m.id = ms.message_id
+                    SET ms.status = %s
+                    WHERE ms.user_id = %s AND m.room_id = %s AND m.id <= %s
+                      AND ms.status != 'read' AND ms.status != %s
+                """, (status, user_id, room_id, up_to, status))
+            conn.commit()
+
+def advance_watermarks(user_id, status, message_ids, watermarks):
+    """
+    Watermark model: move the user's last delivered/read id forward per room
+    (never back) and reset the cached unread count for rooms that were read.
+    Explicit ids count as acknowledging everything up to the highest one.
+    """
+    watermarks = dict(watermarks)
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if message_ids:
+                cursor.execute(f"""
+                    SELECT room_id, MAX(id) AS up_to FROM messages
+                    WHERE id IN ({','.join(['%s'] * len(message_ids))})
+                    GROUP BY room_id
+                """, list(message_ids))
+                for row in cursor.fetchall():
+                    watermarks[row['room_id']] = max(row['up_to'], watermarks.get(row['room_id'], 0))
+            unread = {}
+            for room_id, up_to in watermarks.items():
+                if status == 'read':
+                    cursor.execute("""
+                        UPDATE room_participants
+                        SET last_read_message_id = GREATEST(last_read_message_id, %s),
+                            last_delivered_message_id = GREATEST(last_delivered_message_id, %s)
+                        WHERE room_id = %s AND user_id = %s
+                    """, (up_to, up_to, room_id, user_id))
+                    cursor.execute("""
+                        SELECT COUNT(*) AS n FROM messages m
+                        JOIN room_participants rp ON rp.room_id = m.room_id AND rp.user_id = %s
+                        WHERE m.room_id = %s AND m.id > rp.last_read_message_id AND m.sender_id != %s
+                    """, (user_id, room_id, user_id))
+                    unread[room_id] = cursor.fetchone()['n']
+                else:
+                    cursor.execute("""
+                        UPDATE room_participants
+                        SET last_delivered_message_id = GREATEST(last_delivered_message_id, %s)
+                        WHERE room_id = %s AND user_id = %s
+                    """, (up_to, room_id, user_id))
+            conn.commit()
+    for room_id, n in unread.items():
+        unread_counters.set(user_id, room_id, n)
+
+def load_unread_counts(user_id):
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT rp.room_id, COUNT(m.id) AS n FROM room_participants rp
+                JOIN messages m ON m.room_id = rp.room_id AND m.id > rp.last_read_message_id
+                WHERE rp.user_id = %s AND m.sender_id != rp.user_id
+                GROUP BY rp.room_id
+            """, (user_id,))
+            return {row['room_id']: row['n'] for row in cursor.fetchall()}
+
+@socket_io.on('fetch_unread_counts')
+@rate_limited('fetch_unread_counts')
+def handle_fetch_unread_counts(data):
+    """Unread count per room ({room_id: n}) from the cached counters (watermark model)."""
+    user_id = connected_users.user_for(request.sid) or (data or {}).get('user_id')
+    if not user_id:
+        emit('fetch_unread_counts_response', {"success": False, "message": "Missing user_id"}, to=request.sid)
+        return
+    if config.UNREAD_MODEL != 'watermark':
+        emit('fetch_unread_counts_response', {"success": False, "message": "Unread counts need UNREAD_MODEL=watermark"}, to=request.sid)
+        return
+    try:
+        counts = unread_counters.get(user_id, lambda: load_unread_counts(user_id))
+        emit('fetch_unread_counts_response', {"success": True, "counts": counts}, to=request.sid)
+    except Exception as e:
+        emit('fetch_unread_counts_response', {"success": False, "message": str(e)}, to=request.sid)
 
 def mark_message_delivered(message_id, user_id):
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        cursor.execute("""
-            UPDATE message_status SET status='delivered'
-            WHERE message_id=%s AND user_id=%s
-        """, (message_id, user_id))
-        conn.commit()
-    conn.close()
+    mark_messages_status(user_id, 'delivered', [message_id], {})
 
 def mark_message_read(message_id, user_id):
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        cursor.execute("""
-            UPDATE message_status SET status='read'
-            WHERE message_id=%s AND user_id=%s
-        """, (message_id, user_id))
-        conn.commit()
-    conn.close()
+    mark_messages_status(user_id, 'read', [message_id], {})
+MESSAGE_COLUMNS = "m.id, m.room_id, m.sender_id, m.message, m.type, m.created_at"
+
+def message_row(entry):
+    """A saved write-path entry in the shape of a MESSAGE_COLUMNS row."""
+    return {
+        'id': entry['id'],
+        'room_id': entry['room_id'],
+        'sender_id': entry['sender_id'],
+        'message': entry['message'],
+        'type': entry.get('type', 'text'),
+        'created_at': entry['created_at'],
+    }
+
+def serialize_message(row):
+    row = dict(row)
+    if isinstance(row.get('created_at'), datetime.datetime):
+        row['created_at'] = row['created_at'].isoformat()
+    return row
+
+def page_size(data):
+    return max(1, min(int(data.get('limit') or config.HISTORY_PAGE_DEFAULT), config.HISTORY_PAGE_MAX))
+
+@socket_io.on('fetch_rooms')
+@rate_limited('fetch_rooms')
+def handle_fetch_rooms(data):
+    """
+    Conversation list, most recent activity first: {'limit': 30, 'offset': 0}.
+    Each room has name (the other user's name for private rooms), last
+    message preview/sender/id/time and the user's unread count.
+    """
+    data = data or {}
+    user_id = connected_users.user_for(request.sid)
+    if not user_id:
+        emit('fetch_rooms_response', {"success": False, "message": "Register first"}, to=request.sid)
+        return
+    try:
+        limit = max(1, min(int(data.get('limit') or config.ROOMS_PAGE_DEFAULT), config.ROOMS_PAGE_MAX))
+        offset = max(0, int(data.get('offset') or 0))
+        room_ids, has_more = room_index.page(user_id, offset, limit, lambda: load_room_activity(user_id))
+        summaries = room_index.summaries(room_ids, load_room_summaries)
+        unread = page_unread_counts(user_id, room_ids)
+        rooms = []
+        for room_id in room_ids:
+            summary = summaries.get(room_id)
+            if summary is None:
+                continue
+            member_names = summary.pop('member_names')
+            if not summary['is_group']:
+                peers = {uid: name for uid, name in member_names.items() if uid != str(user_id)}
+                summary['peer_id'] = int(next(iter(peers))) if peers else None
+                summary['name'] = next(iter(peers.values()), summary['name'])
+            rooms.append(dict(summary, room_id=int(room_id), unread=unread.get(room_id, 0)))
+        emit('fetch_rooms_response', {
+            "success": True,
+            "rooms": rooms,
+            "has_more": has_more,
+            "next_offset": offset + len(room_ids),
+        }, to=request.sid)
+    except Exception as e:
+        emit('fetch_rooms_response', {"success": False, "message": str(e)}, to=request.sid)
+
+def load_room_activity(user_id):
+    """{room_id: timestamp of last activity} for every room of the user."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT rp.room_id, COALESCE(cr.last_message_at, cr.created_at) AS active_at
+                FROM room_participants rp JOIN chat_rooms cr ON cr.id = rp.room_id
+                WHERE rp.user_id = %s AND rp.room_id != 0
+            """, (user_id,))
+            return {row['room_id']: row['active_at'].timestamp() if row['active_at'] else 0
+                    for row in cursor.fetchall()}
+
+def load_room_summaries(room_ids):
+    """
+    {room_id: (static fields, latest message or None)} for the given rooms:
+    one query for the rooms and their newest message, one for the names of
+    private-room participants.
+    """
+    placeholders = ','.join(['%s'] * len(room_ids))
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT cr.id AS room_id, cr.name, cr.is_group, cr.pair_key,
+                       m.id, m.sender_id, m.message, m.created_at
+                FROM chat_rooms cr
+                LEFT JOIN messages m ON m.id = (
+                    SELECT MAX(id) FROM messages WHERE room_id = cr.id AND is_deleted = FALSE
+                )
+                WHERE cr.id IN ({placeholders})
+            """, [int(r) for r in room_ids])
+            rows = cursor.fetchall()
+            pair_ids = {int(uid) for row in rows if not row['is_group'] and row['pair_key']
+                        for uid in row['pair_key'].split(':')}
+            names = {}
+            if pair_ids:
+                cursor.execute(f"""
+                    SELECT id, username FROM users WHERE id IN ({','.join(['%s'] * len(pair_ids))})
+                """, list(pair_ids))
+                names = {str(row['id']): row['username'] for row in cursor.fetchall()}
+    summaries = {}
+    for row in rows:
+        member_names = {}
+        if not row['is_group'] and row['pair_key']:
+            member_names = {uid: names.get(uid, '') for uid in row['pair_key'].split(':')}
+        static = {'name': row['name'] or '', 'is_group': 1 if row['is_group'] else 0, 'member_names': member_names}
+        summaries[row['room_id']] = (static, row if row['id'] is not None else None)
+    return summaries
+
+def page_unread_counts(user_id, room_ids):
+    """{room_id (str): unread count} for one page of rooms."""
+    if not room_ids:
+        return {}
+    if config.UNREAD_MODEL == 'watermark':
+        counts = unread_counters.get(user_id, lambda: load_unread_counts(user_id))
+        return {room_id: counts.get(room_id, 0) for room_id in room_ids}
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT m.room_id, COUNT(*) AS n FROM message_status ms
+                JOIN messages m ON m.id = ms.message_id
+                WHERE ms.user_id = %s AND ms.status != 'read' AND m.room_id IN ({','.join(['%s'] * len(room_ids))})
+                GROUP BY m.room_id
+            """, [user_id] + [int(r) for r in room_ids])
+            return {str(row['room_id']): row['n'] for row in cursor.fetchall()}
+
+@socket_io.on('fetch_history')
+@rate_limited('fetch_history')
+def handle_fetch_history(data):
+    """
+    Keyset-paginated room history, oldest first within a page.
+    {'room_id': 5}                    latest page
+    {'room_id': 5, 'before_id': 120}  older page (ids < 120)
+    {'room_id': 5, 'after_id': 120}   newer page (ids > 120)
+    """
+    user_id = connected_users.user_for(request.sid) or data.get('user_id')
+    room_id = data.get('room_id')
+    if not user_id or not room_id:
+        emit('fetch_history_response', {"success": False, "message": "Missing user_id or room_id"}, to=request.sid)
+        return
+    try:
+        if not membership.is_member(room_id, user_id, lambda: load_room_member_ids(room_id)):
+            emit('fetch_history_response', {"success": False, "message": "Not a member of this room"}, to=request.sid)
+            return
+        limit = page_size(data)
+        messages, has_more = fetch_history_page(int(room_id), limit, data.get('before_id'), data.get('after_id'))
+        emit('fetch_history_response', {
+            "success": True,
+            "room_id": room_id,
+            "messages": [serialize_message(m) for m in messages],
+            "has_more": has_more,
+        }, to=request.sid)
+    except Exception as e:
+        emit('fetch_history_response', {"success": False, "message": str(e)}, to=request.sid)
+
+def fetch_history_page(room_id, limit, before_id=None, after_id=None):
+    """Returns (messages ascending by id, has_more in the paging direction)."""
+    if before_id is None and after_id is None and limit <= config.ROOM_HISTORY_CACHE_SIZE:
+        try:
+            return fetch_latest_page(room_id, limit)
+        except redis.RedisError as re:
+            print(f"Redis error reading history cache: {re}")
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            if after_id is not None:
+                cursor.execute(f"""
+                    SELECT {MESSAGE_COLUMNS} FROM messages m
+                    WHERE m.room_id = %s AND m.id > %s AND m.is_deleted = FALSE
+                    ORDER BY m.id ASC LIMIT %s
+                """, (room_id, int(after_id), limit + 1))
+                rows = cursor.fetchall()
+                return rows[:limit], len(rows) > limit
+            if before_id is not None:
+                cursor.execute(f"""
+                    SELECT {MESSAGE_COLUMNS} FROM messages m
+                    WHERE m.room_id = %s AND m.id < %s AND m.is_deleted = FALSE
+                    ORDER BY m.id DESC LIMIT %s
+                """, (room_id, int(before_id), limit + 1))
+            else:
+                cursor.execute(f"""
+                    SELECT {MESSAGE_COLUMNS} FROM messages m
+                    WHERE m.room_id = %s AND m.is_deleted = FALSE
+                    ORDER BY m.id DESC LIMIT %s
+                """, (room_id, limit + 1))
+            rows = cursor.fetchall()
+    return list(reversed(rows[:limit])), len(rows) > limit
+
+def fetch_latest_page(room_id, limit):
+    """Latest page from the room's recent-history cache, filling it from MySQL on a miss."""
+    cached = recent_history.latest(room_id, limit)
+    if cached is not None:
+        return cached
+    size = config.ROOM_HISTORY_CACHE_SIZE
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {MESSAGE_COLUMNS} FROM messages m
+                WHERE m.room_id = %s AND m.is_deleted = FALSE
+                ORDER BY m.id DESC LIMIT %s
+            """, (room_id, size + 1))
+            rows = cursor.fetchall()
+    recent_history.fill(room_id, [serialize_message(r) for r in rows[:size]], complete=len(rows) <= size)
+    return list(reversed(rows[:limit])), len(rows) > limit
+
 @socket_io.on('fetch_unread')
+@rate_limited('fetch_unread')
 def handle_fetch_unread(data):
-    user_id = data.get('user_id')
+    """
+    {'user_id': 3, 'after_id': 0, 'limit': 50, 'room_id': 5}   one page, continue from next_after_id
+    {'user_id': 3, 'stream': True}                              every unread message, emitted in
+                                                                 'fetch_unread_chunk' events
+    """
+    user_id = connected_users.user_for(request.sid) or data.get('user_id')
     if not user_id:
         emit('fetch_unread_response', {
             "success": False,
@@ -269,25 +1132,75 @@ def handle_fetch_unread(data):
         }, to=request.sid)
         return
     try:
-        messages = fetch_unread_messages(user_id)
+        after_id = int(data.get('after_id') or 0)
+        room_id = data.get('room_id')
+        if data.get('stream'):
+            stream_unread_messages(user_id, after_id, room_id, request.sid)
+            return
+        limit = page_size(data)
+        messages = fetch_unread_messages(user_id, after_id, limit + 1, room_id)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
         emit('fetch_unread_response', {
             "success": True,
-            "messages": messages
+            "messages": [serialize_message(m) for m in messages],
+            "has_more": has_more,
+            "next_after_id": messages[-1]['id'] if messages else after_id,
         }, to=request.sid)
     except Exception as e:
         emit('fetch_unread_response', {
             "success": False,
             "message": str(e)
         }, to=request.sid)
-def fetch_unread_messages(user_id):
-    conn = get_db_connection()
-    with conn.cursor() as cursor:
-        cursor.execute("""
-            SELECT m.* FROM messages m
-            JOIN message_status ms ON m.id = ms.message_id
-            WHERE ms.user_id=%s AND ms.status != 'read'
-            ORDER BY m.created_at ASC
-        """, (user_id,))
-        messages = cursor.fetchall()
-    conn.close()
+
+def unread_query(room_id):
+    room_filter = "AND m.room_id = %s" if room_id is not None else ""
+    if config.UNREAD_MODEL == 'watermark':
+        return f"""
+            SELECT {MESSAGE_COLUMNS} FROM room_participants rp
+            JOIN messages m ON m.room_id = rp.room_id AND m.id > rp.last_read_message_id
+            WHERE rp.user_id = %s AND m.sender_id != rp.user_id AND m.id > %s {room_filter}
+            ORDER BY m.id ASC
+        """
+    return f"""
+        SELECT {MESSAGE_COLUMNS} FROM message_status ms
+        JOIN messages m ON m.id = ms.message_id
+        WHERE ms.user_id = %s AND ms.status != 'read' AND ms.message_id > %s {room_filter}
+        ORDER BY ms.message_id ASC
+    """
+
+def unread_params(user_id, after_id, room_id):
+    return (user_id, after_id) + ((int(room_id),) if room_id is not None else ())
+
+def fetch_unread_messages(user_id, after_id=0, limit=None, room_id=None):
+    query = unread_query(room_id)
+    params = unread_params(user_id, after_id, room_id)
+    if limit is not None:
+        query += " LIMIT %s"
+        params += (limit,)
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            messages = cursor.fetchall()
     return messages
+
+def stream_unread_messages(user_id, after_id, room_id, sid):
+    """
+    Walk the unread set with an unbuffered cursor and emit it in chunks as
+    rows arrive, so neither the server nor the client holds it all at once.
+    """
+    last_id = after_id
+    with get_db_connection() as conn:
+        with conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute(unread_query(room_id), unread_params(user_id, after_id, room_id))
+            while True:
+                rows = cursor.fetchmany(config.STREAM_CHUNK_SIZE)
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+                emit('fetch_unread_chunk', {
+                    "messages": [serialize_message(m) for m in rows],
+                    "done": False,
+                }, to=sid)
+                socket_io.sleep(0)  # let other greenlets run between chunks
+    emit('fetch_unread_chunk', {"messages": [], "done": True, "next_after_id": last_id}, to=sid)
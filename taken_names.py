@@ -0,0 +1,84 @@
+import re
+import threading
+import time
+import unicodedata
+
+import redis
+
+from bloom import RedisBloomFilter
+
+BLOOM_KEY = "taken_names:bloom"
+
+
+def normalize(name):
+    """
+    Key for the Bloom filter, at least as coarse as the users columns'
+    case- and accent-insensitive collation: names MySQL treats as equal must
+    map to the same key ('Élise'/'elise', 'straße'/'strasse'/'strase' under
+    either utf8mb4 collation). Folding some other names together too is
+    harmless; a collision only means a MySQL lookup.
+    """
+    folded = unicodedata.normalize('NFKD', name.strip()).casefold()
+    folded = ''.join(c for c in folded if not unicodedata.combining(c))
+    return re.sub(r'(.)\1+', r'\1', folded)
+
+
+class TakenNames:
+    """
+    Bloom filter over every username and email in the users table, shared by
+    all workers in Redis. A miss means the name is definitely free; a hit
+    still has to be confirmed in MySQL. Registrations on any worker are added
+    straight away, so misses stay exact. A periodic rebuild (by one worker)
+    only clears out names that were deleted.
+    """
+
+    def __init__(self, client, load_names, capacity, error_rate, rebuild_interval):
+        self.load_names = load_names  # callable yielding every taken username/email
+        self.rebuild_interval = rebuild_interval
+        self._filter = RedisBloomFilter(client, BLOOM_KEY, capacity, error_rate)
+        self._rebuilding = False
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def might_be_taken(self, name):
+        """False: definitely free. True: maybe taken. None: no complete filter yet."""
+        try:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._next_check = now + min(60.0, self.rebuild_interval)
+                built_at = self._filter.built_at()
+                if built_at is None or time.time() - built_at > self.rebuild_interval:
+                    self._start_rebuild()
+            return self._filter.might_contain(normalize(name))
+        except redis.RedisError as re:
+            print(f"Redis error reading taken-names filter: {re}")
+            return None
+
+    def add(self, *names):
+        try:
+            self._filter.add(*(normalize(name) for name in names))
+        except redis.RedisError as re:
+            # A missed addition would make the filter wrongly say 'free'; stop trusting it until rebuilt
+            print(f"Redis error adding to taken-names filter: {re}")
+            try:
+                self._filter.invalidate()
+            except redis.RedisError:
+                pass
+
+    def _start_rebuild(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        # A green thread once eventlet has monkey-patched threading
+        threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            # Returns False right away if another worker is already building
+            self._filter.build(normalize(name) for name in self.load_names() if name)
+        except Exception as e:
+            print(f"❌ Failed to build taken-names filter: {e}")
+        finally:
+            with self._lock:
+                self._rebuilding = False
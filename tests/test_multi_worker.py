@@ -0,0 +1,103 @@
+"""
+Two workers sharing one Redis: an emit on worker A reaches a socket on
+worker B through the Socket.IO message queue, and presence is shared.
+Redis is a fakeredis server common to both workers (needs fakeredis[lua]).
+"""
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+flask = pytest.importorskip("flask")
+flask_socketio = pytest.importorskip("flask_socketio")
+socketio_redis_manager = pytest.importorskip("socketio.redis_manager")
+
+from presence import RedisPresence, user_room
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    server = fakeredis.FakeServer()
+    # Every redis:// URL (the message queue of both workers) opens the shared fake server
+    monkeypatch.setattr(
+        socketio_redis_manager.redis.Redis, 'from_url',
+        classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs)),
+    )
+    return server
+
+
+def make_worker():
+    app = flask.Flask(__name__)
+    return flask_socketio.SocketIO(app, async_mode='threading', message_queue='redis://queue')
+
+
+def connect_to_room(sio, room):
+    """
+    A client connected to this worker and joined to room, at the manager
+    level: flask_socketio's test client refuses to run with a message queue.
+    Returns the list that collects the packets sent to it.
+    """
+    server = sio.server
+    server.manager_initialized = True
+    server.manager.initialize()  # starts the queue listener
+    sid = server.manager.connect('eio-client', '/')
+    server.manager.enter_room(sid, '/', room)
+    sent = []
+
+    def send_eio_packet(eio_sid, eio_pkt):
+        sent.append((eio_sid, server.packet_class(encoded_packet=eio_pkt.data).data))
+
+    # What the manager calls for each recipient of an emit
+    server._send_eio_packet = send_eio_packet
+    return sent
+
+
+def wait_for(sent, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not sent and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return sent
+
+
+def test_emit_on_worker_a_reaches_client_on_worker_b(redis_server):
+    sio_a = make_worker()
+    sio_b = make_worker()
+    sent_b = connect_to_room(sio_b, user_room('7'))
+    time.sleep(0.2)  # let B's queue listener subscribe
+
+    payload = {'from': '5', 'to': '7', 'msg': 'hello from A'}
+    sio_a.emit('chat', payload, to=user_room('7'))
+
+    assert wait_for(sent_b) == [('eio-client', ['chat', payload])]
+
+
+def test_presence_is_shared_between_workers(redis_server):
+    worker_a = RedisPresence(fakeredis.FakeRedis(server=redis_server, decode_responses=True), ttl=60, worker_id='a')
+    worker_b = RedisPresence(fakeredis.FakeRedis(server=redis_server, decode_responses=True), ttl=60, worker_id='b')
+
+    assert worker_b.add('7', 'sid-b1') is True
+    assert worker_b.add('7', 'sid-b1') is False  # same sid registering again
+    assert worker_a.is_online('7')
+    assert worker_a.add('7', 'sid-a1') is False  # second sid, already online
+
+    # Offline only when the last sid on any worker leaves
+    assert worker_b.remove('7', 'sid-b1') is False
+    assert worker_b.is_online('7')
+    assert worker_a.remove('7', 'sid-a1') is True
+    assert not worker_b.is_online('7')
+
+
+def test_crashed_workers_sids_do_not_keep_user_online(redis_server):
+    client = fakeredis.FakeRedis(server=redis_server, decode_responses=True)
+    worker_a = RedisPresence(client, ttl=60, worker_id='a')
+    worker_b = RedisPresence(client, ttl=60, worker_id='b')
+
+    assert worker_a.add('7', 'sid-a1') is True
+    assert worker_b.add('7', 'sid-b1') is False
+    client.delete('presence_worker:a')  # worker A dies without removing its sid
+
+    worker_b.refresh(['7'])
+    assert client.hkeys('presence:7') == ['sid-b1']
+    # B's sid was the last live one, so the user goes offline
+    assert worker_b.remove('7', 'sid-b1') is True
+    assert not worker_b.is_online('7')
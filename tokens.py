@@ -0,0 +1,60 @@
+import hashlib
+import time
+
+import jwt
+
+from cache import LRUCache
+
+REVOKED_TOKENS_KEY = "revoked_tokens"  # sorted set of token hashes scored by their exp
+
+
+def token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenVerifier:
+    """
+    Verifies login JWTs, remembering tokens that already passed the
+    signature check until their exp so reconnects skip the HMAC. Revoked
+    tokens live in a Redis sorted set shared by all workers.
+    """
+
+    def __init__(self, secret, client, cache_size):
+        self.secret = secret
+        self.client = client
+        self._verified = LRUCache(cache_size)  # token hash -> (user_id, exp)
+
+    def verify(self, token):
+        """Returns the token's user_id as str, or None if it is invalid, expired or revoked."""
+        if not token:
+            return None
+        digest = token_hash(token)
+        cached = self._verified.get(digest)
+        if cached is not None and cached[1] <= time.time():
+            self._verified.pop(digest)
+            cached = None
+        if cached is None:
+            try:
+                payload = jwt.decode(token, self.secret, algorithms=['HS256'])
+            except jwt.InvalidTokenError:
+                return None
+            cached = (str(payload['user_id']), payload['exp'])
+            self._verified.set(digest, cached)
+        if self.client.zscore(REVOKED_TOKENS_KEY, digest) is not None:
+            self._verified.pop(digest)
+            return None
+        return cached[0]
+
+    def revoke(self, token):
+        """Revoke a valid token until it would have expired anyway. Returns False for invalid tokens."""
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            return False
+        digest = token_hash(token)
+        pipe = self.client.pipeline()
+        pipe.zadd(REVOKED_TOKENS_KEY, {digest: payload['exp']})
+        pipe.zremrangebyscore(REVOKED_TOKENS_KEY, '-inf', time.time())
+        pipe.execute()
+        self._verified.pop(digest)
+        return True
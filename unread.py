@@ -0,0 +1,59 @@
+UNREAD_KEY_PREFIX = "unread:"  # unread:<user_id> -> hash of room_id -> unread count
+LOADED_FIELD = "_loaded"        # marks a hash that was filled from MySQL, even if every count is 0
+
+_INCR_IF_LOADED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+end
+return 0
+"""
+
+_SET_IF_LOADED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+return 0
+"""
+
+
+class UnreadCounters:
+    """
+    Per-user unread counts by room, cached in Redis and bumped on send. A
+    user's hash is filled from MySQL on first read; increments before that
+    are dropped because the load counts those messages anyway.
+    """
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+        self._incr_if_loaded = client.register_script(_INCR_IF_LOADED_SCRIPT)
+        self._set_if_loaded = client.register_script(_SET_IF_LOADED_SCRIPT)
+
+    def _key(self, user_id):
+        return f"{UNREAD_KEY_PREFIX}{user_id}"
+
+    def incr(self, counts):
+        """counts: {(user_id, room_id): n} new messages per recipient and room."""
+        if not counts:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for (user_id, room_id), n in counts.items():
+            self._incr_if_loaded(keys=[self._key(user_id)], args=[room_id, n], client=pipe)
+        pipe.execute()
+
+    def set(self, user_id, room_id, count):
+        self._set_if_loaded(keys=[self._key(user_id)], args=[room_id, count])
+
+    def get(self, user_id, loader):
+        """{room_id (str): count} with zero counts left out; loader() -> {room_id: count} from MySQL."""
+        key = self._key(user_id)
+        counts = self.client.hgetall(key)
+        if not counts:
+            counts = {str(room_id): n for room_id, n in loader().items()}
+            pipe = self.client.pipeline()
+            pipe.hset(key, mapping=dict(counts, **{LOADED_FIELD: 1}))
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        else:
+            self.client.expire(key, self.ttl)
+        return {room_id: int(n) for room_id, n in counts.items() if room_id != LOADED_FIELD and int(n) > 0}
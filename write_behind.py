@@ -0,0 +1,115 @@
+import atexit
+import threading
+import time
+
+try:
+    from eventlet.queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+
+class WriteBehindQueue:
+    """
+    Buffers rows in memory and hands them to `flush_fn` in batches from a
+    background task. flush_fn receives a list of queued items and must write
+    them in one go (multi-row INSERT etc.). A batch that keeps failing is
+    retried item by item; items that still fail are logged and dropped.
+    """
+
+    def __init__(self, flush_fn, batch_size, flush_interval, max_queue, put_timeout, max_attempts=3):
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_attempts = max_attempts
+        self._queue = Queue(maxsize=max_queue)
+        self._running = False
+        self._start_lock = threading.Lock()
+        self._stats = {"queued": 0, "flushed": 0, "batches": 0, "rejected": 0, "failed": 0}
+
+    def ensure_started(self, start_background_task):
+        if self._running:
+            return
+        with self._start_lock:
+            if self._running:
+                return
+            self._running = True
+            start_background_task(self._run)
+            atexit.register(self.stop)
+
+    def submit(self, item):
+        """
+        Queue an item for the next flush. Blocks up to put_timeout while the
+        queue is full and returns False if it is still full, so the caller can
+        fall back to a synchronous write.
+        """
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except Full:
+            self._stats["rejected"] += 1
+            return False
+        self._stats["queued"] += 1
+        return True
+
+    def _collect_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.flush_fn(batch)
+                self._stats["flushed"] += len(batch)
+                self._stats["batches"] += 1
+                return
+            except Exception as e:
+                error = e
+                print(f"❌ Write-behind flush of {len(batch)} rows failed (attempt {attempt}): {e}")
+                time.sleep(min(0.1 * attempt, 1.0))
+        if len(batch) > 1:
+            # One bad row fails the whole INSERT; write rows one by one so only it is lost
+            for item in batch:
+                self._write([item])
+            return
+        self._stats["failed"] += 1
+        print(f"❌ Dropped write-behind row after {self.max_attempts} attempts: {batch[0]!r} ({error})")
+
+    def _run(self):
+        while self._running:
+            batch = self._collect_batch()
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        """Synchronously write everything currently queued."""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self):
+        self._running = False
+        self.flush()
+
+    def stats(self):
+        return dict(self._stats, pending=self._queue.qsize(), running=self._running)